@@ -1,14 +1,42 @@
 import asyncio
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import io
+import functools
 import json
+import math
+import multiprocessing
 import os
 import random
+import secrets
+import signal
+import sqlite3
+import sys
+import threading
 import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from aiohttp import web
+from pydantic import BaseModel
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.default import Default
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.filters import BaseFilter
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.utils.chat_action import ChatActionSender
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.types import (
+    BufferedInputFile,
     FSInputFile,
     KeyboardButton,
     ReplyKeyboardMarkup,
@@ -18,6 +46,19 @@ from aiogram.types import (
     PreCheckoutQuery,
 )
 
+try:
+    import fcntl
+except ImportError:  # Windows: без міжпроцесного локу на журнал платежів
+    fcntl = None
+
+try:
+    from PIL import Image
+
+    import spread_render
+except ImportError:  # без Pillow перевернуті картки беремо з готових *_rev.jpg
+    Image = None
+    spread_render = None
+
 # =========================
 # ENV
 # =========================
@@ -29,7 +70,13 @@ if not API_TOKEN:
 if not PROVIDER_TOKEN:
     raise RuntimeError("PROVIDER_TOKEN is not set (get it from @BotFather -> Payments -> Portmone)")
 
-bot = Bot(token=API_TOKEN)
+# напр. http://127.0.0.1:8081 — локальний Bot API сервер або scripts/fake_bot_api.py
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")
+
+bot = Bot(
+    token=API_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None,
+)
 dp = Dispatcher()
 # === DEV / ADMIN ===
 DEV_MODE = os.getenv("DEV_MODE", "0") == "1"
@@ -50,39 +97,33 @@ async def cmd_grant_me(message: types.Message):
     if not is_admin(uid):
         return
     st = await add_credits(uid, credits=999, natal=True)
-    await message.answer(f"✅ Test access granted\ncredits={st['credits']}\nnatal={st['natal']}")
+    await sync_state()
+    await message.answer(f"✅ Test access granted\ncredits={st.credits}\nnatal={st.natal}")
+# user_id -> pending kind: тільки юзери, від яких зараз чекаємо відповідь.
+# Фільтр перевіряє його за O(1) без локів і без звернення до сховища.
+_pending_index: dict[int, str] = {}
+
+
 class PendingKind(BaseFilter):
     def __init__(self, kind: str):
         self.kind = kind
 
     async def __call__(self, message: types.Message) -> bool:
-        st = await get_user_state(message.from_user.id)
-        p = st.get("pending")
-        return isinstance(p, dict) and p.get("kind") == self.kind
+        return _pending_index.get(message.from_user.id) == self.kind
 
 
 async def set_pending(user_id: int, kind: str) -> None:
-    uid = str(user_id)
-    async with _state_lock:
-        if uid not in _state:
-            _state[uid] = _default_user_state()
-        _state[uid]["pending"] = {"kind": kind, "ts": int(time.time())}
-    await save_state()
+    await _store.set_pending(user_id, kind)
+    _pending_index[user_id] = kind
 
 
 async def clear_pending(user_id: int) -> None:
-    uid = str(user_id)
-    async with _state_lock:
-        if uid not in _state:
-            _state[uid] = _default_user_state()
-        _state[uid]["pending"] = None
-    await save_state()
+    await _store.set_pending(user_id, None)
+    _pending_index.pop(user_id, None)
 
 
-def can_start_reading(st: dict) -> bool:
-    credits = int(st.get("credits", 0))
-    free_used = int(st.get("free_used", 0))
-    return credits > 0 or free_used < FREE_READINGS
+def can_start_reading(st: "UserRecord") -> bool:
+    return st.credits > 0 or st.free_used < FREE_READINGS
 
 
 ASK_QUESTION_KB = ReplyKeyboardMarkup(
@@ -90,6 +131,8 @@ ASK_QUESTION_KB = ReplyKeyboardMarkup(
     keyboard=[[KeyboardButton(text="❌ Скасувати")]],
 )
 
+THREE_CARDS_POSITIONS = ("🕰 Минуле", "🌟 Теперішнє", "🔮 Майбутнє")
+
 CELTIC_CROSS_POSITIONS = [
     "1️⃣ *Серце питання (теперішнє)*",
     "2️⃣ *Перехрестя (виклик)*",
@@ -104,6 +147,15 @@ CELTIC_CROSS_POSITIONS = [
 ]
 
 
+THREE_CARDS_HEADER = "*Три карти — шлях душі*\n\n"
+THREE_CARDS_TRAILER = "Три нитки сплелись… шлях уже змінюється ✨"
+CELTIC_CROSS_HEADER = "*✨ Кельтський хрест — повне ворожіння*\n"
+CELTIC_CROSS_TRAILER = (
+    "🧿 *Порада:* дивись на 1↔2 (конфлікт), 3↔5 (корінь↔намір), 7↔8 (ти↔оточення).\n\n"
+    "Готово ✨"
+)
+
+
 def md_escape(s: str) -> str:
     # для parse_mode="Markdown"
     return (
@@ -115,22 +167,52 @@ def md_escape(s: str) -> str:
     )
 
 
-def draw_unique_cards(n: int):
-    # безопасно: если колода маленькая — не зависаем
-    drawn = []
-    seen = set()
-    attempts = 0
-    while len(drawn) < n and attempts < 500:
-        code, orient, path = get_random_card()
-        attempts += 1
-        if code in seen:
-            continue
-        seen.add(code)
-        drawn.append((code, orient, path))
-    # если не удалось добрать уникальные — добиваем любыми
-    while len(drawn) < n:
-        drawn.append(get_random_card())
-    return drawn
+def draw_unique_cards(n: int) -> list["CardEntry"]:
+    return draw_engine.draw(n)
+
+
+@dp.message(Command("cache_stats"))
+async def cmd_cache_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    if not isinstance(_store, CachedStateBackend):
+        await message.answer("State cache is disabled (STATE_BACKEND=sqlite + STATE_CACHE_SIZE>0).")
+        return
+    st = _store.stats()
+    total = st["hits"] + st["misses"]
+    hit_rate = st["hits"] / total * 100 if total else 0.0
+    await message.answer(
+        f"🗃 State cache: {st['entries']}/{st['max_entries']}\n"
+        f"hits={st['hits']} misses={st['misses']} ({hit_rate:.1f}% hit)\n"
+        f"evictions={st['evictions']} dirty={st['dirty']}"
+    )
+
+
+@dp.message(Command("queue_stats"))
+async def cmd_queue_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    st = outbound.stats()
+    await message.answer(
+        f"📤 Outbound: depth={st['depth']} (max {st['max_depth']}), chats={st['chats']}\n"
+        f"sent={st['sent']} waited={st['waited']} "
+        f"wait avg={st['wait_avg'] * 1000:.0f}ms max={st['wait_max'] * 1000:.0f}ms\n"
+        f"retry_after={st['retry_after']} ({st['retry_after_sum']}s) gave_up={st['gave_up']}"
+    )
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    await message.answer(_stats_summary() + "\n\n" + api_metrics.summary())
+
+
+@dp.message(Command("state_stats"))
+async def cmd_state_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    await message.answer(state_io.summary())
 
 
 @dp.message(Command("reset_me"))
@@ -138,9 +220,8 @@ async def cmd_reset_me(message: types.Message):
     uid = message.from_user.id
     if not is_admin(uid):
         return
-    async with _state_lock:
-        _state[str(uid)] = _default_user_state()
-    await save_state()
+    await _store.reset(uid)
+    _pending_index.pop(uid, None)
     await message.answer("♻️ Reset OK")
 
 
@@ -164,8 +245,21 @@ DISCLAIMER_TEXT = (
 # =========================
 FREE_READINGS = 3
 STATE_PATH = Path(os.getenv("STATE_PATH", "users_state.json"))
-_state_lock = asyncio.Lock()
-_state: dict[str, dict] = {}  # user_id(str) -> {"free_used": int, "credits": int, "natal": bool}
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json").lower()  # json | sqlite
+STATE_DB_PATH = Path(os.getenv("STATE_DB_PATH", "users_state.sqlite3"))
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "0"))  # LRU гарячих юзерів над sqlite; 0 = вимкнено
+# журнал мутаций вместо полной перезаписи STATE_PATH на каждое нажатие
+STATE_JOURNAL = os.getenv("STATE_JOURNAL", "0") == "1"
+STATE_LOG_PATH = STATE_PATH.with_suffix(".log")
+STATE_LOG_OLD_PATH = STATE_PATH.with_suffix(".log.old")
+STATE_COMPACT_INTERVAL = float(os.getenv("STATE_COMPACT_INTERVAL", "300"))  # сек
+STATE_COMPACT_MIN_BYTES = int(os.getenv("STATE_COMPACT_MIN_BYTES", "65536"))
+# group commit: все мутации за окно сливаются в одну запись на диск
+STATE_FLUSH_WINDOW = float(os.getenv("STATE_FLUSH_WINDOW_MS", "250")) / 1000
+STATE_LOCK_STRIPES = int(os.getenv("STATE_LOCK_STRIPES", "64"))
+# крок збереження (очікування локу, серіалізація, запис, fsync, запит у sqlite)
+# довший за поріг — ⚠️ у лог; 0 = не логувати
+STATE_SLOW_MS = float(os.getenv("STATE_SLOW_MS", "100"))
 
 # Portmone зазвичай працює з UAH у Telegram Payments
 CURRENCY = "UAH"
@@ -601,84 +695,1331 @@ ALL_CODES = list(NAMES.keys())
 # =========================
 # STATE HELPERS
 # =========================
-def _default_user_state() -> dict:
-    return {"free_used": 0, "credits": 0, "natal": False, "pending": None}
+PENDING_KINDS = ("celtic_cross",)  # код у flags = індекс + 1 (0 — нічого не чекаємо)
 
 
+class UserRecord:
+    """Компактний запис юзера: __slots__, int-поля, natal і pending-kind в одному flags.
 
-def _load_state_sync() -> dict[str, dict]:
-    if not STATE_PATH.exists():
-        return {}
-    try:
-        return json.loads(STATE_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
+    Записи не змінюються після публікації у сховищі (copy-on-write): кожна
+    мутація повертає новий UserRecord.
+    """
 
+    __slots__ = ("free_used", "credits", "flags", "pending_ts")
+
+    NATAL = 0b1
+    PENDING_SHIFT = 1
+    PENDING_MASK = 0b1110
+
+    def __init__(self, free_used: int = 0, credits: int = 0, flags: int = 0, pending_ts: int = 0):
+        self.free_used = free_used
+        self.credits = credits
+        self.flags = flags
+        self.pending_ts = pending_ts
+
+    def __repr__(self) -> str:
+        return (
+            f"UserRecord(free_used={self.free_used}, credits={self.credits}, "
+            f"natal={self.natal}, pending={self.pending_kind!r})"
+        )
 
-def _save_state_sync(state: dict[str, dict]) -> None:
+    @property
+    def natal(self) -> bool:
+        return bool(self.flags & self.NATAL)
+
+    @property
+    def pending_kind(self) -> str | None:
+        code = (self.flags & self.PENDING_MASK) >> self.PENDING_SHIFT
+        return PENDING_KINDS[code - 1] if code else None
+
+    def copy(self) -> "UserRecord":
+        return UserRecord(self.free_used, self.credits, self.flags, self.pending_ts)
+
+    def with_credits(self, credits: int, natal: bool = False) -> "UserRecord":
+        rec = self.copy()
+        rec.credits += int(credits)
+        if natal:
+            rec.flags |= self.NATAL
+        return rec
+
+    def with_pending(self, kind: str | None) -> "UserRecord":
+        rec = self.copy()
+        rec.flags &= ~self.PENDING_MASK
+        rec.pending_ts = 0
+        if kind is not None:
+            rec.flags |= (PENDING_KINDS.index(kind) + 1) << self.PENDING_SHIFT
+            rec.pending_ts = int(time.time())
+        return rec
+
+    def consumed(self) -> "UserRecord | None":
+        """Списати 1 кредит або 1 безкоштовне; None -> нема чим платити."""
+        if self.credits > 0:
+            rec = self.copy()
+            rec.credits -= 1
+            return rec
+        if self.free_used < FREE_READINGS:
+            rec = self.copy()
+            rec.free_used += 1
+            return rec
+        return None
+
+    def to_json(self) -> dict:
+        kind = self.pending_kind
+        return {
+            "free_used": self.free_used,
+            "credits": self.credits,
+            "natal": self.natal,
+            "pending": {"kind": kind, "ts": self.pending_ts} if kind else None,
+        }
+
+    @classmethod
+    def from_json(cls, d: dict) -> "UserRecord":
+        flags = cls.NATAL if d.get("natal", False) else 0
+        pending, ts = d.get("pending"), 0
+        if isinstance(pending, dict) and pending.get("kind") in PENDING_KINDS:
+            flags |= (PENDING_KINDS.index(pending["kind"]) + 1) << cls.PENDING_SHIFT
+            ts = int(pending.get("ts", 0))
+        return cls(int(d.get("free_used", 0)), int(d.get("credits", 0)), flags, ts)
+
+
+def _load_state_sync() -> dict[int, UserRecord]:
+    state = {}
+    if STATE_PATH.exists():
+        try:
+            raw = json.loads(STATE_PATH.read_text(encoding="utf-8"))
+            state = {int(uid): UserRecord.from_json(st) for uid, st in raw.items()}
+        except Exception:
+            state = {}
+    if STATE_JOURNAL:
+        # снапшот + журнал: сначала старый (если компакция прервалась), потом текущий
+        _replay_journal_sync(state, STATE_LOG_OLD_PATH)
+        _replay_journal_sync(state, STATE_LOG_PATH)
+    return state
+
+
+def _save_state_sync(state: dict[int, UserRecord]) -> None:
     tmp = STATE_PATH.with_suffix(".tmp")
-    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    t0 = time.perf_counter()
+    data = {str(uid): rec.to_json() for uid, rec in state.items()}
+    payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    t1 = time.perf_counter()
+    tmp.write_bytes(payload)
+    t2 = time.perf_counter()
     tmp.replace(STATE_PATH)
+    t3 = time.perf_counter()
+    observe_state("snapshot_serialize", t1 - t0)
+    observe_state("snapshot_write", t2 - t1)
+    observe_state("snapshot_replace", t3 - t2)
+    state_io.saved("snapshot", len(payload))
+
+
+# =========================
+# STATE JOURNAL (append-only)
+# =========================
+# Каждая мутация дописывает одну строку {"u": uid, "s": {...}} с полным
+# состоянием юзера, поэтому повторный replay идемпотентен: побеждает последняя
+# запись. Компактор периодически сворачивает журнал в снапшот STATE_PATH.
+def _journal_append_sync(records: list[tuple[int, UserRecord]]) -> None:
+    t0 = time.perf_counter()
+    data = "".join(
+        json.dumps({"u": str(uid), "s": rec.to_json()}, ensure_ascii=False, separators=(",", ":")) + "\n"
+        for uid, rec in records
+    ).encode("utf-8")
+    t1 = time.perf_counter()
+    with open(STATE_LOG_PATH, "ab") as f:
+        f.write(data)
+        f.flush()
+        t2 = time.perf_counter()
+        os.fsync(f.fileno())
+    t3 = time.perf_counter()
+    observe_state("journal_serialize", t1 - t0)
+    observe_state("journal_write", t2 - t1)
+    observe_state("journal_fsync", t3 - t2)
+    state_io.saved("journal", len(data))
+
+
+def _replay_journal_sync(state: dict[int, UserRecord], path: Path) -> None:
+    if not path.exists():
+        return
+    good = 0  # байтовое смещение конца последней целой записи
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # оборванная запись (краш посреди append)
+            good += len(line)
+            try:
+                rec = json.loads(line)
+                state[int(rec["u"])] = UserRecord.from_json(rec["s"])
+            except Exception as e:
+                # битая строка в середине: пропускаем, а записи после неё сохраняем
+                print(f"⚠️ state journal {path.name}: skipping corrupt line at byte {good - len(line)}: {e!r}")
+    if good < path.stat().st_size:
+        # отрезаем хвост, чтобы новые записи не склеились с мусором
+        with open(path, "r+b") as f:
+            f.truncate(good)
+
+
+def _compact_state_sync(snapshot: dict[int, UserRecord]) -> None:
+    _save_state_sync(snapshot)
+    STATE_LOG_OLD_PATH.unlink(missing_ok=True)
+
+
+# =========================
+# STATE BACKENDS
+# =========================
+class TimedLock:
+    """asyncio.Lock, що пише час очікування на нього в STATE_SECONDS."""
+
+    __slots__ = ("_lock", "_step")
+
+    def __init__(self, step: str):
+        self._lock = asyncio.Lock()
+        self._step = step
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def __aenter__(self) -> None:
+        t0 = time.perf_counter()
+        await self._lock.acquire()
+        observe_state(self._step, time.perf_counter() - t0)
+
+    async def __aexit__(self, *exc) -> None:
+        self._lock.release()
+
+
+class StateBackend(ABC):
+    """Сховище стану юзерів. Усі хелпери нижче працюють лише через цей інтерфейс."""
+
+    async def load(self) -> None:
+        pass
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def sync(self) -> None:
+        """Бар'єр: повертається, коли всі попередні мутації вже на диску."""
+        pass
+
+    @abstractmethod
+    async def get(self, user_id: int) -> UserRecord:
+        ...
+
+    @abstractmethod
+    async def add_credits(self, user_id: int, credits: int, natal: bool = False) -> UserRecord:
+        ...
+
+    @abstractmethod
+    async def set_pending(self, user_id: int, kind: str | None) -> None:
+        ...
+
+    @abstractmethod
+    async def consume_reading(self, user_id: int) -> bool:
+        """True -> списали 1 кредит або 1 безкоштовне ворожіння."""
+
+    @abstractmethod
+    async def reset(self, user_id: int) -> None:
+        ...
+
+    @abstractmethod
+    async def pending_users(self) -> dict[int, str]:
+        """user_id -> pending kind для всіх, у кого він активний (для _pending_index)."""
+
+
+class BufferedStateBackend(StateBackend):
+    """Group commit: мутації лише позначають юзера брудним, а фоновий флашер
+    раз на STATE_FLUSH_WINDOW пише їх усіх одним заходом через _write()."""
+
+    def __init__(self):
+        self._dirty: set = set()
+        self._dirty_seq = 0  # номер останньої мутації
+        self._flushed_seq = 0  # до якого номера все вже на диску
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()  # close(): фонові задачі доходять до кінця кроку й виходять
+        self._flush_lock = TimedLock("flush_lock_wait")
+        self._flushed = asyncio.Condition()
+        self._flusher: asyncio.Task | None = None
+        # striped locks: юзери з різних смуг ніколи не чекають один одного
+        self._locks = [TimedLock("lock_wait") for _ in range(STATE_LOCK_STRIPES)]
+
+    def _lock_for(self, uid) -> TimedLock:
+        return self._locks[int(uid) % len(self._locks)]
+
+    @abstractmethod
+    async def _write(self, dirty: set) -> None:
+        """Записати стан юзерів із dirty; викликається під _flush_lock."""
+
+    async def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flusher_loop())
+
+    async def close(self) -> None:
+        # не cancel(): скасування посеред _write відпустило б _flush_lock, поки потік
+        # ще пише, і фінальний _flush писав би той самий .tmp паралельно
+        self._stop.set()
+        self._wake.set()
+        if self._flusher:
+            await self._flusher
+            self._flusher = None
+        await self._flush()
+
+    def _mark_dirty(self, uid) -> None:
+        self._dirty.add(uid)
+        self._dirty_seq += 1
+        self._wake.set()
+
+    async def _flush(self) -> None:
+        """Записати всіх брудних юзерів одним заходом."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            seq = self._dirty_seq
+            dirty, self._dirty = self._dirty, set()
+            t0 = time.perf_counter()
+            try:
+                await self._write(dirty)
+            except Exception:
+                self._dirty |= dirty  # не втрачаємо — спробуємо наступного разу
+                raise
+            observe_state("flush", time.perf_counter() - t0)
+            self._flushed_seq = max(self._flushed_seq, seq)
+        async with self._flushed:
+            self._flushed.notify_all()
+
+    async def _flusher_loop(self) -> None:
+        while not self._stop.is_set():
+            await self._wake.wait()
+            # вікно group commit; зупинка його обриває
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), STATE_FLUSH_WINDOW)
+            self._wake.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                print(f"⚠️ state flush failed: {e!r}")
+                self._wake.set()
+
+    async def sync(self) -> None:
+        target = self._dirty_seq
+        if self._flusher is None:
+            # фонового флашера немає (ще не стартували / вже зупинили) — пишемо самі
+            await self._flush()
+            return
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: self._flushed_seq >= target)
+
+
+class JsonStateBackend(BufferedStateBackend):
+    """Весь стан у пам'яті + users_state.json (опційно з журналом).
+
+    Записи юзерів не змінюються на місці (copy-on-write): мутація кладе в
+    _state новий UserRecord. Тому для збереження достатньо поверхневої копії
+    _state, а серіалізація йде у потоці без жодних локів.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._state: dict[int, UserRecord] = {}
+        self._compactor: asyncio.Task | None = None
+
+    def _user(self, uid: int) -> UserRecord:
+        rec = self._state.get(uid)
+        if rec is None:
+            rec = self._state[uid] = UserRecord()
+        return rec
+
+    async def load(self) -> None:
+        self._state = await asyncio.to_thread(_load_state_sync)
+
+    async def start(self) -> None:
+        if STATE_JOURNAL:
+            await self.compact()  # стартуем с чистого журнала
+            self._compactor = asyncio.create_task(self._compactor_loop())
+        await super().start()
+
+    async def close(self) -> None:
+        self._stop.set()
+        if self._compactor:
+            await self._compactor
+            self._compactor = None
+        await super().close()
+
+    async def save(self) -> None:
+        t0 = time.perf_counter()
+        snapshot = dict(self._state)  # записи незмінні — вистачає копії словника
+        observe_state("snapshot_copy", time.perf_counter() - t0)
+        await asyncio.to_thread(_save_state_sync, snapshot)
+
+    async def _write(self, dirty: set) -> None:
+        if STATE_JOURNAL:
+            records = [(uid, self._user(uid)) for uid in dirty]
+            await asyncio.to_thread(_journal_append_sync, records)
+        else:
+            await self.save()
+
+    async def compact(self) -> None:
+        async with self._flush_lock:
+            # ротация журнала и копия состояния — атомарно относительно флашера,
+            # всё, что придёт после, попадёт уже в новый STATE_LOG_PATH
+            if STATE_LOG_PATH.exists() and not STATE_LOG_OLD_PATH.exists():
+                STATE_LOG_PATH.replace(STATE_LOG_OLD_PATH)
+            t0 = time.perf_counter()
+            snapshot = dict(self._state)
+            observe_state("snapshot_copy", time.perf_counter() - t0)
+        await asyncio.to_thread(_compact_state_sync, snapshot)
+
+    async def _compactor_loop(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), STATE_COMPACT_INTERVAL)
+            if self._stop.is_set():
+                return
+            try:
+                size = STATE_LOG_PATH.stat().st_size if STATE_LOG_PATH.exists() else 0
+                if size >= STATE_COMPACT_MIN_BYTES:
+                    await self.compact()
+            except Exception as e:
+                print(f"⚠️ state compaction failed: {e!r}")
+
+    async def get(self, user_id: int) -> UserRecord:
+        async with self._lock_for(user_id):
+            return self._user(user_id)
+
+    async def add_credits(self, user_id: int, credits: int, natal: bool = False) -> UserRecord:
+        async with self._lock_for(user_id):
+            rec = self._state[user_id] = self._user(user_id).with_credits(credits, natal)
+        self._mark_dirty(user_id)
+        return rec
+
+    async def set_pending(self, user_id: int, kind: str | None) -> None:
+        async with self._lock_for(user_id):
+            self._state[user_id] = self._user(user_id).with_pending(kind)
+        self._mark_dirty(user_id)
+
+    async def consume_reading(self, user_id: int) -> bool:
+        async with self._lock_for(user_id):
+            rec = self._user(user_id).consumed()
+            if rec is None:
+                return False
+            self._state[user_id] = rec
+        self._mark_dirty(user_id)
+        return True
+
+    async def reset(self, user_id: int) -> None:
+        async with self._lock_for(user_id):
+            self._state[user_id] = UserRecord()
+        self._mark_dirty(user_id)
+
+    async def pending_users(self) -> dict[int, str]:
+        return {uid: rec.pending_kind for uid, rec in self._state.items() if rec.pending_kind}
+
+
+class SQLiteStateBackend(StateBackend):
+    """Один рядок на юзера, точкові UPDATE замість дампу всього стану."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+    def _connect_sync(self) -> None:
+        # timeout: з WORKERS>1 в базу пишуть кілька процесів
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id INTEGER PRIMARY KEY,"
+            " free_used INTEGER NOT NULL DEFAULT 0,"
+            " credits INTEGER NOT NULL DEFAULT 0,"
+            " natal INTEGER NOT NULL DEFAULT 0,"
+            " pending TEXT)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS users_pending ON users(user_id) WHERE pending IS NOT NULL")
+        (count,) = db.execute("SELECT COUNT(*) FROM users").fetchone()
+        if count == 0 and STATE_PATH.exists():
+            # одноразова міграція зі старого users_state.json
+            legacy = _load_state_sync()
+            with db:
+                db.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, free_used, credits, natal, pending) VALUES (?, ?, ?, ?, ?)",
+                    [self._record_to_row(uid, rec) for uid, rec in legacy.items()],
+                )
+        self._db = db
+
+    def _call(self, fn, *args):
+        t0 = time.perf_counter()
+        with self._db_lock:
+            t1 = time.perf_counter()
+            db = self._db
+            changes = db.total_changes
+            try:
+                result = fn(db, *args)
+            finally:
+                observe_state("sqlite_lock_wait", t1 - t0)
+                observe_state("sqlite" + fn.__name__.removesuffix("_sync"), time.perf_counter() - t1)
+            # кожен виклик, що щось записав, — одне збереження (і точкові UPDATE, і put_many)
+            if fn is not SQLiteStateBackend._close_sync and db.total_changes != changes:
+                state_io.saved("sqlite")
+            return result
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._call, fn, *args)
+
+    @staticmethod
+    def _row_to_record(row) -> UserRecord:
+        if row is None:
+            return UserRecord()
+        free_used, credits, natal, pending = row
+        return UserRecord.from_json({
+            "free_used": free_used,
+            "credits": credits,
+            "natal": bool(natal),
+            "pending": json.loads(pending) if pending else None,
+        })
+
+    @staticmethod
+    def _record_to_row(user_id: int, rec: UserRecord) -> tuple:
+        st = rec.to_json()
+        return (
+            int(user_id),
+            rec.free_used,
+            rec.credits,
+            int(rec.natal),
+            json.dumps(st["pending"]) if st["pending"] else None,
+        )
+
+    @staticmethod
+    def _get_sync(db: sqlite3.Connection, user_id: int) -> UserRecord:
+        row = db.execute(
+            "SELECT free_used, credits, natal, pending FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return SQLiteStateBackend._row_to_record(row)
+
+    @staticmethod
+    def _add_credits_sync(db: sqlite3.Connection, user_id: int, credits: int, natal: bool) -> UserRecord:
+        db.execute(
+            "INSERT INTO users (user_id, credits, natal) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "credits = credits + excluded.credits, natal = MAX(natal, excluded.natal)",
+            (user_id, int(credits), int(bool(natal))),
+        )
+        return SQLiteStateBackend._get_sync(db, user_id)
+
+    @staticmethod
+    def _set_pending_sync(db: sqlite3.Connection, user_id: int, pending: str | None) -> None:
+        db.execute(
+            "INSERT INTO users (user_id, pending) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET pending = excluded.pending",
+            (user_id, pending),
+        )
+
+    @staticmethod
+    def _consume_sync(db: sqlite3.Connection, user_id: int) -> bool:
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            cur = db.execute(
+                "UPDATE users SET credits = credits - 1 WHERE user_id = ? AND credits > 0", (user_id,)
+            )
+            if cur.rowcount == 0:
+                cur = db.execute(
+                    "UPDATE users SET free_used = free_used + 1 WHERE user_id = ? AND free_used < ?",
+                    (user_id, FREE_READINGS),
+                )
+            return cur.rowcount > 0
+
+    @staticmethod
+    def _pending_users_sync(db: sqlite3.Connection) -> dict[int, str]:
+        rows = db.execute("SELECT user_id, pending FROM users WHERE pending IS NOT NULL").fetchall()
+        return {uid: json.loads(pending).get("kind") for uid, pending in rows}
+
+    @staticmethod
+    def _put_many_sync(db: sqlite3.Connection, records: list[tuple[int, UserRecord]]) -> None:
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO users (user_id, free_used, credits, natal, pending) VALUES (?, ?, ?, ?, ?)",
+                [SQLiteStateBackend._record_to_row(uid, rec) for uid, rec in records],
+            )
+
+    @staticmethod
+    def _close_sync(db: sqlite3.Connection) -> None:
+        db.close()
+
+    @staticmethod
+    def _reset_sync(db: sqlite3.Connection, user_id: int) -> None:
+        db.execute(
+            "INSERT OR REPLACE INTO users (user_id, free_used, credits, natal, pending) VALUES (?, 0, 0, 0, NULL)",
+            (user_id,),
+        )
+
+    async def load(self) -> None:
+        if self._db is None:
+            await asyncio.to_thread(self._connect_sync)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._run(self._close_sync)
+            self._db = None
+
+    async def get(self, user_id: int) -> UserRecord:
+        return await self._run(self._get_sync, user_id)
+
+    async def add_credits(self, user_id: int, credits: int, natal: bool = False) -> UserRecord:
+        return await self._run(self._add_credits_sync, user_id, credits, natal)
+
+    async def set_pending(self, user_id: int, kind: str | None) -> None:
+        pending = UserRecord().with_pending(kind).to_json()["pending"]
+        await self._run(self._set_pending_sync, user_id, json.dumps(pending) if pending else None)
+
+    async def consume_reading(self, user_id: int) -> bool:
+        return await self._run(self._consume_sync, user_id)
+
+    async def reset(self, user_id: int) -> None:
+        await self._run(self._reset_sync, user_id)
+
+    async def pending_users(self) -> dict[int, str]:
+        return await self._run(self._pending_users_sync)
+
+    async def put_many(self, records: list[tuple[int, UserRecord]]) -> None:
+        if records:
+            await self._run(self._put_many_sync, records)
+
+
+class CachedStateBackend(BufferedStateBackend):
+    """Обмежений LRU гарячих юзерів поверх персистентного сховища.
+
+    Промах — ліниве читання з inner; мутації йдуть у кеш і пишуться назад
+    пачкою (group commit). Брудний запис ніколи не витісняється, поки не
+    ляже в inner: до того він живе в _evicting і звідти ж читається.
+    """
+
+    def __init__(self, inner: SQLiteStateBackend, max_entries: int):
+        super().__init__()
+        self.inner = inner
+        self.max_entries = max_entries
+        self._cache: OrderedDict[int, UserRecord] = OrderedDict()
+        self._evicting: dict[int, UserRecord] = {}
+        self._writing: set = set()  # юзери, чий write-back у inner зараз у польоті
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "dirty": len(self._dirty),
+        }
+
+    async def load(self) -> None:
+        await self.inner.load()
+
+    async def close(self) -> None:
+        await super().close()
+        await self.inner.close()
+
+    async def _write(self, dirty: set) -> None:
+        records = []
+        for uid in dirty:
+            rec = self._cache.get(uid) or self._evicting.get(uid)
+            if rec is not None:
+                records.append((uid, rec))
+        self._writing = dirty
+        try:
+            await self.inner.put_many(records)
+        finally:
+            self._writing = set()
+
+    async def _user(self, uid: int) -> UserRecord:
+        # викликати лише під self._lock_for(uid)
+        rec = self._cache.get(uid)
+        if rec is not None:
+            self.hits += 1
+            self._cache.move_to_end(uid)
+            return rec
+        self.misses += 1
+        # запис повертається в кеш — звідси його й пише _write, у _evicting він більше не живе
+        rec = self._evicting.pop(uid, None)
+        if rec is None:
+            rec = await self.inner.get(uid)
+        self._cache[uid] = rec
+        return rec
+
+    async def _evict(self) -> None:
+        victims = []
+        while len(self._cache) > self.max_entries:
+            uid, rec = self._cache.popitem(last=False)
+            self.evictions += 1
+            # _flush уже забрав юзера з _dirty, але put_many ще не завершився —
+            # inner поки що віддасть старий рядок, тож тримаємо запис і тут
+            if uid in self._dirty or uid in self._writing:
+                self._evicting[uid] = rec
+                victims.append(uid)
+        if victims:
+            try:
+                await self._flush()  # write-back до того, як запис зникне з пам'яті
+            except Exception as e:
+                # _flush повернув їх у _dirty; тримаємо записи в кеші до наступної спроби
+                print(f"⚠️ state cache eviction write-back failed: {e!r}")
+                for uid in victims:
+                    rec = self._evicting.pop(uid, None)
+                    if rec is not None and uid not in self._cache:
+                        self._cache[uid] = rec
+                        self._cache.move_to_end(uid, last=False)
+                return
+            for uid in victims:
+                if uid not in self._dirty and uid not in self._writing:
+                    self._evicting.pop(uid, None)
+
+    async def _update(self, user_id: int, fn) -> UserRecord | None:
+        async with self._lock_for(user_id):
+            rec = fn(await self._user(user_id))
+            if rec is not None:
+                self._cache[user_id] = rec
+                self._mark_dirty(user_id)
+        if len(self._cache) > self.max_entries:
+            await self._evict()
+        return rec
+
+    async def get(self, user_id: int) -> UserRecord:
+        async with self._lock_for(user_id):
+            rec = await self._user(user_id)
+        if len(self._cache) > self.max_entries:
+            await self._evict()
+        return rec
+
+    async def add_credits(self, user_id: int, credits: int, natal: bool = False) -> UserRecord:
+        return await self._update(user_id, lambda rec: rec.with_credits(credits, natal))
+
+    async def set_pending(self, user_id: int, kind: str | None) -> None:
+        await self._update(user_id, lambda rec: rec.with_pending(kind))
+
+    async def consume_reading(self, user_id: int) -> bool:
+        return await self._update(user_id, UserRecord.consumed) is not None
+
+    async def reset(self, user_id: int) -> None:
+        await self._update(user_id, lambda rec: UserRecord())
+
+    async def pending_users(self) -> dict[int, str]:
+        found = await self.inner.pending_users()
+        # кеш свіжіший за inner
+        for uid, rec in (*self._evicting.items(), *self._cache.items()):
+            if rec.pending_kind:
+                found[uid] = rec.pending_kind
+            else:
+                found.pop(uid, None)
+        return found
+
+
+def _make_state_backend() -> StateBackend:
+    if STATE_BACKEND == "json":
+        return JsonStateBackend()
+    if STATE_BACKEND == "sqlite":
+        if STATE_CACHE_SIZE > 0:
+            return CachedStateBackend(SQLiteStateBackend(STATE_DB_PATH), STATE_CACHE_SIZE)
+        return SQLiteStateBackend(STATE_DB_PATH)
+    raise RuntimeError(f"Unknown STATE_BACKEND: {STATE_BACKEND!r} (expected 'json' or 'sqlite')")
+
+
+_store: StateBackend = _make_state_backend()
 
 
 async def load_state() -> None:
-    global _state
-    async with _state_lock:
-        _state = await asyncio.to_thread(_load_state_sync)
+    await _store.load()
+    _pending_index.clear()
+    _pending_index.update(await _store.pending_users())
 
 
-async def save_state() -> None:
-    async with _state_lock:
-        await asyncio.to_thread(_save_state_sync, _state)
+async def get_user_state(user_id: int) -> UserRecord:
+    return await _store.get(user_id)
 
 
-async def get_user_state(user_id: int) -> dict:
-    uid = str(user_id)
-    async with _state_lock:
-        if uid not in _state:
-            _state[uid] = _default_user_state()
-        return _state[uid]
+async def add_credits(user_id: int, credits: int, natal: bool = False) -> UserRecord:
+    return await _store.add_credits(user_id, credits, natal=natal)
 
 
-async def add_credits(user_id: int, credits: int, natal: bool = False) -> dict:
-    uid = str(user_id)
-    async with _state_lock:
-        if uid not in _state:
-            _state[uid] = _default_user_state()
-        _state[uid]["credits"] = int(_state[uid].get("credits", 0)) + int(credits)
-        if natal:
-            _state[uid]["natal"] = True
-    await save_state()
-    return await get_user_state(user_id)
-
-
-def get_main_menu() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[
-        [KeyboardButton(text="🔮 Одна карта — порада долі")],
-        [KeyboardButton(text="🃏 Три карти — шлях душі")],
-        [KeyboardButton(text="✨ Кельтський хрест — повне ворожіння")],
-        [KeyboardButton(text="❓ Так / Ні — швидка відповідь")],
-        [KeyboardButton(text="🪐 Натальна карта")],
-        [KeyboardButton(text="💳 Купити ворожіння")],
-        [KeyboardButton(text="📜 Дисклеймер")],
-    ])
+async def sync_state() -> None:
+    """Дочекатися, поки зміни стану (напр. нараховані кредити) ляжуть на диск."""
+    await _store.sync()
 
 
-def get_paywall_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🪄 Купити 5 ворожінь — 99 грн", callback_data="buy_pack_5")],
-        [InlineKeyboardButton(text="🔮 Купити 10 ворожінь + 🪐 — 199 грн", callback_data="buy_pack_10")],
-        [InlineKeyboardButton(text="📜 Дисклеймер", callback_data="show_disclaimer")],
-        [InlineKeyboardButton(text="🔙 Назад у меню", callback_data="back_menu")],
-    ])
+# статичні клавіатури збираємо один раз; хендлери лише посилаються на них
+MAIN_MENU_KB = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[
+    [KeyboardButton(text="🔮 Одна карта — порада долі")],
+    [KeyboardButton(text="🃏 Три карти — шлях душі")],
+    [KeyboardButton(text="✨ Кельтський хрест — повне ворожіння")],
+    [KeyboardButton(text="❓ Так / Ні — швидка відповідь")],
+    [KeyboardButton(text="🪐 Натальна карта")],
+    [KeyboardButton(text="💳 Купити ворожіння")],
+    [KeyboardButton(text="📜 Дисклеймер")],
+])
+
 
+PAYWALL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🪄 Купити 5 ворожінь — 99 грн", callback_data="buy_pack_5")],
+    [InlineKeyboardButton(text="🔮 Купити 10 ворожінь + 🪐 — 199 грн", callback_data="buy_pack_10")],
+    [InlineKeyboardButton(text="📜 Дисклеймер", callback_data="show_disclaimer")],
+    [InlineKeyboardButton(text="🔙 Назад у меню", callback_data="back_menu")],
+])
 
-def get_disclaimer_confirm_kb(pack_key: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+DISCLAIMER_CONFIRM_KB = {
+    pack_key: InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Погоджуюсь і перейти до оплати", callback_data=f"confirm_{pack_key}")],
         [InlineKeyboardButton(text="📜 Показати дисклеймер ще раз", callback_data="show_disclaimer")],
         [InlineKeyboardButton(text="❌ Скасувати", callback_data="back_menu")],
     ])
+    for pack_key in PACKS
+}
+
+
+# =========================
+# OUTBOUND SCHEDULER
+# =========================
+# Усі виклики Bot API проходять через bot.session, тож ліміти Telegram тримаємо
+# в одному request-middleware: відро токенів на чат (~1 повідомлення/с) і
+# глобальне (~30/с). Платіжні відправки проходять глобальне відро першими.
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))        # повідомлень/с в один чат
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))      # скільки можна відправити підряд
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))   # повідомлень/с на весь бот
+SEND_GLOBAL_BURST = float(os.getenv("SEND_GLOBAL_BURST", "30"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))      # повторів після RetryAfter
+SEND_CHAT_BUCKETS_MAX = 10_000                                  # далі чистимо неактивні відра
+
+PRIORITY_PAYMENT = 0
+PRIORITY_NORMAL = 1
+
+# методи, які Telegram не рахує як повідомлення
+_UNLIMITED_METHODS = {"SendChatAction"}
+_PAYMENT_METHODS = {"SendInvoice", "AnswerPreCheckoutQuery"}
+
+_send_priority: "contextvars.ContextVar[int]" = contextvars.ContextVar("send_priority", default=PRIORITY_NORMAL)
+
+
+@contextlib.contextmanager
+def payment_priority():
+    """Відправки всередині блоку (напр. підтвердження оплати) йдуть поза чергою."""
+    token = _send_priority.set(PRIORITY_PAYMENT)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+class TokenBucket:
+    """Відро токенів; acquire() віддає токени в порядку звернень."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def penalize(self, seconds: float) -> None:
+        """Telegram попросив зачекати: наступний токен з'явиться не раніше ніж через seconds.
+
+        acquire() чекає, поки tokens дорости до 1, тож відраховуємо від 1, а не від 0.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 1.0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return not self._lock.locked() and self.tokens >= self.burst
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class PriorityTokenBucket(TokenBucket):
+    """Глобальне відро: коли токенів бракує, першими обслуговуємо менший priority."""
+
+    def __init__(self, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._pump_task: asyncio.Task | None = None
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await fut
+
+    async def _pump(self) -> None:
+        while self._waiters:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # той, хто чекав, уже скасований
+                continue
+            self.tokens -= 1
+            fut.set_result(None)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Request-middleware для bot.session: кожне повідомлення спершу бере токен
+    у відрі свого чату, потім у глобальному. TelegramRetryAfter не летить у
+    хендлер — чекаємо скільки просить Telegram і повторюємо. Чекаємо в одному
+    місці: штрафуємо відро чату, і паузу відбуває _acquire (разом з іншими
+    відправками в той самий чат); без чату — просто спимо.
+    """
+
+    def __init__(self, chat_rate: float, chat_burst: float, global_rate: float, global_burst: float,
+                 max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = PriorityTokenBucket(global_rate, global_burst)
+        self._chats: dict[int | str, TokenBucket] = {}
+        self.depth = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.waited = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.retry_after = 0
+        self.retry_after_sum = 0
+        self.gave_up = 0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= SEND_CHAT_BUCKETS_MAX:
+                for key in [k for k, b in self._chats.items() if b.idle]:
+                    del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int) -> None:
+        t0 = time.monotonic()
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        try:
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self._global.acquire(priority)
+        finally:
+            self.depth -= 1
+        waited = time.monotonic() - t0
+        self.sent += 1
+        self.wait_sum += waited
+        self.wait_max = max(self.wait_max, waited)
+        if waited >= 0.001:
+            self.waited += 1
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        if name in _UNLIMITED_METHODS or (chat_id is None and name not in _PAYMENT_METHODS):
+            # getUpdates, answerCallbackQuery тощо — не повідомлення
+            return await make_request(bot, method)
+
+        priority = PRIORITY_PAYMENT if name in _PAYMENT_METHODS else _send_priority.get()
+        if name == "AnswerPreCheckoutQuery":
+            chat_id = None  # на відповідь є лише 10 секунд — чат не чекаємо
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                self.retry_after_sum += e.retry_after
+                if attempt >= self.max_retries:
+                    self.gave_up += 1
+                    raise
+                attempt += 1
+                delay = e.retry_after + random.uniform(0, 0.5 * attempt)
+                print(f"⏳ flood control on {name} (chat {chat_id}): retry in {delay:.1f}s "
+                      f"({attempt}/{self.max_retries})")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).penalize(delay)  # дочекається наступний _acquire
+                else:
+                    await asyncio.sleep(delay)
+
+    def share_global(self, parts: int) -> None:
+        """Глобальний ліміт рахується на бота: кожен із parts процесів бере свою частку."""
+        g = self._global
+        g.rate /= parts
+        g.burst = max(g.burst / parts, 1.0)
+        g.tokens = min(g.tokens, g.burst)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "waited": self.waited,
+            "wait_avg": self.wait_sum / self.sent if self.sent else 0.0,
+            "wait_max": self.wait_max,
+            "retry_after": self.retry_after,
+            "retry_after_sum": self.retry_after_sum,
+            "gave_up": self.gave_up,
+            "chats": len(self._chats),
+        }
+
+
+outbound = OutboundScheduler(
+    SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GLOBAL_RATE, SEND_GLOBAL_BURST, SEND_MAX_RETRIES,
+)
+bot.session.middleware(outbound)
+
+
+# =========================
+# METRICS
+# =========================
+# Гістограми з фіксованими бакетами: запис — це bisect і три інкременти, без
+# локів (усе в одному event loop) і без алокацій, крім першої появи нового лейбла.
+# Прометеус-текст віддаємо на METRICS_PORT (0 = вимкнено), коротке зведення — /stats.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # останній — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оцінка зверху: межа бакета, в який потрапляє q-та частка спостережень."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class HistogramFamily:
+    """Набір гістограм однієї метрики, по одній на значення лейбла."""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.series: dict[str, Histogram] = {}
+
+    def observe(self, key: str, value: float) -> None:
+        hist = self.series.get(key)
+        if hist is None:
+            hist = self.series[key] = Histogram()
+        hist.observe(value)
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, hist in sorted(self.series.items()):
+            label = f'{self.label}="{key}"'
+            cumulative = 0
+            for bound, n in zip((*LATENCY_BUCKETS, "+Inf"), hist.counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {hist.sum:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {hist.count}")
+        return lines
+
+
+HANDLER_SECONDS = HistogramFamily("taro_handler_seconds", "Wall-clock time per handler.", "handler")
+# CPU рахуємо thread_time() до/після: поки хендлер чекає на await, тут же працюють
+# інші задачі, тож під навантаженням це оцінка зверху
+HANDLER_CPU_SECONDS = HistogramFamily("taro_handler_cpu_seconds", "Event-loop CPU time while a handler ran.", "handler")
+UPDATE_SECONDS = HistogramFamily("taro_update_seconds", "Wall-clock time per update type.", "type")
+UPDATE_CPU_SECONDS = HistogramFamily("taro_update_cpu_seconds", "Event-loop CPU time per update type.", "type")
+METRIC_FAMILIES = [HANDLER_SECONDS, HANDLER_CPU_SECONDS, UPDATE_SECONDS, UPDATE_CPU_SECONDS]
+
+
+def _expose_outbound() -> list[str]:
+    st = outbound.stats()
+    return [
+        "# TYPE taro_outbound_queue_depth gauge",
+        f"taro_outbound_queue_depth {st['depth']}",
+        "# TYPE taro_outbound_sent_total counter",
+        f"taro_outbound_sent_total {st['sent']}",
+        "# TYPE taro_outbound_wait_seconds_max gauge",
+        f"taro_outbound_wait_seconds_max {st['wait_max']:.6f}",
+        "# TYPE taro_outbound_retry_after_total counter",
+        f"taro_outbound_retry_after_total {st['retry_after']}",
+    ]
+
+
+# інші підсистеми додають сюди функції, що повертають рядки експозиції
+METRIC_COLLECTORS = [_expose_outbound]
+
+
+def render_metrics() -> str:
+    lines = []
+    for family in METRIC_FAMILIES:
+        lines += family.expose()
+    for collect in METRIC_COLLECTORS:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+async def _time_update(handler, event: types.Update, data: dict):
+    t0 = time.perf_counter()
+    c0 = time.thread_time()
+    try:
+        return await handler(event, data)
+    finally:
+        kind = event.event_type
+        UPDATE_SECONDS.observe(kind, time.perf_counter() - t0)
+        UPDATE_CPU_SECONDS.observe(kind, time.thread_time() - c0)
+
+
+async def _time_handler(handler, event, data: dict):
+    t0 = time.perf_counter()
+    c0 = time.thread_time()
+    try:
+        return await handler(event, data)
+    finally:
+        name = data["handler"].callback.__name__
+        HANDLER_SECONDS.observe(name, time.perf_counter() - t0)
+        HANDLER_CPU_SECONDS.observe(name, time.thread_time() - c0)
+
+
+# outer на update — за типом апдейта; ім'я хендлера відоме лише inner-мідлварям
+dp.update.outer_middleware(_time_update)
+for _observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+    _observer.middleware(_time_handler)
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> web.AppRunner | None:
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"📈 metrics: http://{METRICS_HOST}:{port}/metrics")
+    return runner
+
+
+def _stats_summary() -> str:
+    lines = ["📈 Handlers (n, avg / p95 wall ms, avg cpu ms):"]
+    for name, hist in sorted(HANDLER_SECONDS.series.items(), key=lambda kv: -kv[1].sum):
+        cpu = HANDLER_CPU_SECONDS.series.get(name)
+        cpu_avg = cpu.sum / cpu.count * 1000 if cpu and cpu.count else 0.0
+        lines.append(
+            f"{name}: {hist.count}, {hist.sum / hist.count * 1000:.0f} / "
+            f"≤{hist.quantile(0.95) * 1000:.0f}, {cpu_avg:.1f}"
+        )
+    lines.append("Updates:")
+    for kind, hist in sorted(UPDATE_SECONDS.series.items()):
+        lines.append(f"{kind}: {hist.count}, {hist.sum / hist.count * 1000:.0f} / ≤{hist.quantile(0.95) * 1000:.0f}")
+    return "\n".join(lines)
+
+# =========================
+# BOT API METRICS
+# =========================
+# Request-middleware, зареєстрований після OutboundScheduler, тобто ближче до
+# мережі: латентність — це сам round-trip до Telegram без очікування в черзі.
+API_SECONDS = HistogramFamily("taro_api_seconds", "Bot API round-trip time per method.", "method")
+METRIC_FAMILIES.append(API_SECONDS)
+
+
+class ApiMethodStats:
+    __slots__ = ("bytes", "errors", "retry_after")
+
+    def __init__(self):
+        self.bytes = 0
+        self.errors = 0
+        self.retry_after = 0
+
+
+def _request_bytes(value) -> int:
+    """Приблизний розмір запиту: байти файлів + довжина текстових полів."""
+    if value is None or isinstance(value, Default):
+        return 0  # Default — заглушка налаштувань бота, сесія її не шле (або шле своє значення)
+    if isinstance(value, BufferedInputFile):
+        return len(value.data)
+    if isinstance(value, FSInputFile):
+        try:
+            return os.path.getsize(value.path)
+        except OSError:
+            return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return sum(_request_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_request_bytes(v) for v in value.values())
+    if isinstance(value, BaseModel):
+        return sum(_request_bytes(getattr(value, name)) for name in type(value).model_fields)
+    return len(str(value))
+
+
+class ApiCallMetrics(BaseRequestMiddleware):
+    def __init__(self):
+        self.methods: dict[str, ApiMethodStats] = {}
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = method.__api_method__
+        stats = self.methods.get(name)
+        if stats is None:
+            stats = self.methods[name] = ApiMethodStats()
+        stats.bytes += _request_bytes(method)
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            stats.retry_after += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            API_SECONDS.observe(name, time.perf_counter() - t0)
+
+    def expose(self) -> list[str]:
+        lines = []
+        for metric, attr, help_text in (
+            ("taro_api_request_bytes_total", "bytes", "Request bytes sent per method, uploads included."),
+            ("taro_api_errors_total", "errors", "Failed Bot API calls per method (RetryAfter excluded)."),
+            ("taro_api_retry_after_total", "retry_after", "RetryAfter responses per method."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{method="{name}"}} {getattr(st, attr)}' for name, st in sorted(self.methods.items())]
+        return lines
+
+    def summary(self) -> str:
+        lines = ["📡 Bot API (n, avg / p95 ms, KB sent, err, 429):"]
+        for name, hist in sorted(API_SECONDS.series.items(), key=lambda kv: -kv[1].sum):
+            st = self.methods.get(name) or ApiMethodStats()
+            lines.append(
+                f"{name}: {hist.count}, {hist.sum / hist.count * 1000:.0f} / ≤{hist.quantile(0.95) * 1000:.0f}, "
+                f"{st.bytes / 1024:.0f}, {st.errors}, {st.retry_after}"
+            )
+        return "\n".join(lines)
+
+
+api_metrics = ApiCallMetrics()
+bot.session.middleware(api_metrics)
+METRIC_COLLECTORS.append(api_metrics.expose)
+
+
+# =========================
+# STATE METRICS
+# =========================
+# Кроки збереження стану: очікування локів, копія снапшота, серіалізація, запис,
+# fsync/replace, group-commit флаш і кожен запит у sqlite. Частина кроків іде в
+# потоках (asyncio.to_thread), тому і запис, і читання — під threading.Lock,
+# а гістограму віддає StateIoStats.expose, а не загальний METRIC_FAMILIES.
+STATE_SECONDS = HistogramFamily("taro_state_seconds", "Time per state persistence step.", "step")
+
+
+class StateIoStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes: dict[str, int] = {}  # target -> записано байтів
+        self.saves: dict[str, int] = {}  # target -> кількість збережень
+        self.recent: deque = deque(maxlen=4096)  # monotonic-часи останніх збережень
+        self.slow = 0
+        self._warned: dict[str, list] = {}  # step -> [час останнього ⚠️, пропущено з того часу]
+
+    def observe(self, step: str, seconds: float) -> None:
+        warn = None
+        with self.lock:
+            STATE_SECONDS.observe(step, seconds)
+            if STATE_SLOW_MS and seconds * 1000 >= STATE_SLOW_MS:
+                self.slow += 1
+                # не більше одного рядка на крок за секунду, решту лише рахуємо
+                now = time.monotonic()
+                last = self._warned.setdefault(step, [0.0, 0])
+                if now - last[0] >= 1.0:
+                    warn, last[0], last[1] = last[1], now, 0
+                else:
+                    last[1] += 1
+        if warn is not None:
+            more = f", +{warn} more since last warning" if warn else ""
+            print(f"⚠️ slow state op: {step} took {seconds * 1000:.0f}ms (STATE_SLOW_MS={STATE_SLOW_MS:g}{more})")
+
+    def saved(self, target: str, nbytes: int | None = None) -> None:
+        with self.lock:
+            self.saves[target] = self.saves.get(target, 0) + 1
+            if nbytes is not None:
+                self.bytes[target] = self.bytes.get(target, 0) + nbytes
+            self.recent.append(time.monotonic())
+
+    def saves_per_second(self, window: float = 60.0) -> float:
+        cutoff = time.monotonic() - window
+        with self.lock:
+            return sum(1 for t in self.recent if t >= cutoff) / window
+
+    def expose(self) -> list[str]:
+        with self.lock:
+            lines = STATE_SECONDS.expose()
+            saves, written, slow = dict(self.saves), dict(self.bytes), self.slow
+        lines += [
+            "# HELP taro_state_saves_total State saves per target (snapshot, journal, sqlite).",
+            "# TYPE taro_state_saves_total counter",
+        ]
+        lines += [f'taro_state_saves_total{{target="{t}"}} {n}' for t, n in sorted(saves.items())]
+        lines += ["# TYPE taro_state_bytes_written_total counter"]
+        lines += [f'taro_state_bytes_written_total{{target="{t}"}} {n}' for t, n in sorted(written.items())]
+        lines += ["# TYPE taro_state_slow_ops_total counter", f"taro_state_slow_ops_total {slow}"]
+        return lines
+
+    def summary(self) -> str:
+        lines = ["💾 State (n, avg / p95 ms):"]
+        with self.lock:
+            series = sorted(STATE_SECONDS.series.items(), key=lambda kv: -kv[1].sum)
+            for step, hist in series:
+                lines.append(
+                    f"{step}: {hist.count}, {hist.sum / hist.count * 1000:.2f} / ≤{hist.quantile(0.95) * 1000:.0f}"
+                )
+            for target, n in sorted(self.saves.items()):
+                written = f", {self.bytes[target] / 1024:.0f} KB" if target in self.bytes else ""
+                lines.append(f"saves {target}: {n}{written}")
+            slow = self.slow
+        lines.append(f"saves/s (60s): {self.saves_per_second():.2f}; slow ops ≥{STATE_SLOW_MS:g}ms: {slow}")
+        return "\n".join(lines)
+
+
+state_io = StateIoStats()
+observe_state = state_io.observe
+METRIC_COLLECTORS.append(state_io.expose)
 
 
 # =========================
@@ -689,28 +2030,7 @@ async def consume_reading_or_block(message: types.Message) -> bool:
     True -> можна ворожити (списали 1 безкоштовне або 1 кредит)
     False -> показали paywall
     """
-    user_id = message.from_user.id
-    uid = str(user_id)
-
-    async with _state_lock:
-        if uid not in _state:
-            _state[uid] = _default_user_state()
-
-        st = _state[uid]
-        credits = int(st.get("credits", 0))
-        free_used = int(st.get("free_used", 0))
-
-        if credits > 0:
-            st["credits"] = credits - 1
-            allowed = True
-        elif free_used < FREE_READINGS:
-            st["free_used"] = free_used + 1
-            allowed = True
-        else:
-            allowed = False
-
-    if allowed:
-        await save_state()
+    if await _store.consume_reading(message.from_user.id):
         return True
 
     await message.answer(
@@ -719,11 +2039,137 @@ async def consume_reading_or_block(message: types.Message) -> bool:
         "Щоб я міг відкрити наступний шар підказок долі — потрібна енергія обміну.\n\n"
         "🔮 Обери пакунок нижче — і я продовжу читати знаки для тебе:",
         parse_mode="Markdown",
-        reply_markup=get_paywall_kb(),
+        reply_markup=PAYWALL_KB,
     )
     return False
 
 
+# =========================
+# PAYMENT LEDGER (append-only)
+# =========================
+# Кожен успішний платіж — один рядок у PAYMENT_LEDGER_PATH, ключ —
+# telegram_payment_charge_id. У пам'яті тримаємо індекс charge id, тож
+# повторно доставлений апдейт (рестарт, ретрай мережі) відсікається за O(1).
+# Порядок: запис платежу -> кредити (вже на диску, sync_state) -> рядок
+# {"applied": charge}. Краш між ними лишає платіж без applied, і на старті
+# reconcile_payments() донараховує такі платежі, а не губить їх.
+# З WORKERS>1 файл спільний: append — під flock, а обрізати обірваний хвіст
+# може лише головний процес (writer=True), поки воркери ще не стартували.
+PAYMENT_LEDGER_PATH = Path(os.getenv("PAYMENT_LEDGER_PATH", "payments.log"))
+_payment_charges: dict[str, dict] = {}  # telegram_payment_charge_id -> запис журналу
+_payment_ledger_lock = asyncio.Lock()
+
+
+def _flock(f, exclusive: bool) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _ledger_append_sync(entry: dict) -> None:
+    line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    with open(PAYMENT_LEDGER_PATH, "a+b") as f:
+        _flock(f, exclusive=True)
+        # обірваний хвіст від чужого краху закриваємо, щоб наш запис не склеївся з ним
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load_ledger_sync(writer: bool) -> dict[str, dict]:
+    """writer=False (воркери): лише читаємо й зупиняємось на обірваному хвості."""
+    charges: dict[str, dict] = {}
+    applied: set[str] = set()
+    if not PAYMENT_LEDGER_PATH.exists():
+        return charges
+    good = 0  # зміщення кінця останнього цілого рядка
+    with open(PAYMENT_LEDGER_PATH, "r+b" if writer else "rb") as f:
+        _flock(f, exclusive=writer)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # обірваний запис (краш посеред append)
+            good += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print(f"⚠️ payment ledger: skipping corrupt line at byte {good - len(line)}")
+                continue
+            if "applied" in entry:
+                applied.add(entry["applied"])
+            else:
+                charges[entry["charge"]] = entry
+        if writer and good < f.seek(0, os.SEEK_END):
+            f.truncate(good)
+    for charge in applied & charges.keys():
+        charges[charge]["applied"] = True
+    return charges
+
+
+async def load_payment_ledger(writer: bool = True) -> None:
+    _payment_charges.clear()
+    _payment_charges.update(await asyncio.to_thread(_load_ledger_sync, writer))
+
+
+async def record_payment(user_id: int, sp: types.SuccessfulPayment) -> bool:
+    """False -> цей charge id уже в журналі (дубль апдейта), нараховувати не можна."""
+    charge = sp.telegram_payment_charge_id
+    if charge in _payment_charges:
+        return False
+    pack = PACKS.get(sp.invoice_payload, {})
+    entry = {
+        "charge": charge,
+        "provider_charge": sp.provider_payment_charge_id,
+        "user": user_id,
+        "payload": sp.invoice_payload,
+        "amount": sp.total_amount,
+        "currency": sp.currency,
+        "credits": pack.get("credits", 0),
+        "natal": pack.get("natal", False),
+        "ts": int(time.time()),
+    }
+    # займаємо id до першого await, щоб паралельний дубль його вже побачив
+    _payment_charges[charge] = entry
+    try:
+        async with _payment_ledger_lock:
+            await asyncio.to_thread(_ledger_append_sync, entry)
+    except BaseException:
+        _payment_charges.pop(charge, None)
+        raise
+    return True
+
+
+async def apply_payment(entry: dict) -> UserRecord:
+    """Нараховує кредити платежу і, коли вони вже на диску, позначає його applied."""
+    st = await add_credits(entry["user"], credits=entry["credits"], natal=entry["natal"])
+    await sync_state()
+    async with _payment_ledger_lock:
+        await asyncio.to_thread(_ledger_append_sync, {"applied": entry["charge"], "ts": int(time.time())})
+    entry["applied"] = True
+    return st
+
+
+async def reconcile_payments() -> int:
+    """Донарахувати платежі, записані до краху, але не позначені applied. Лише writer-процес."""
+    pending = [entry for entry in _payment_charges.values() if not entry.get("applied")]
+    for entry in pending:
+        await apply_payment(entry)
+        print(f"💳 payment ledger: re-applied {entry['charge']} for user {entry['user']} (+{entry['credits']})")
+    return len(pending)
+
+
+def check_pre_checkout(query: PreCheckoutQuery) -> str | None:
+    """Причина відмови або None. Лише дані в пам'яті — відповісти треба за 10 секунд."""
+    pack = PACKS.get(query.invoice_payload)
+    if pack is None:
+        return "Такого пакунка вже немає. Відкрий меню й обери ще раз 🙏"
+    if query.currency != CURRENCY or query.total_amount != int(pack["amount"]):
+        return "Ціна пакунка змінилась. Відкрий меню й обери ще раз 🙏"
+    return None
+
+
 # =========================
 # PAYMENTS
 # =========================
@@ -748,7 +2194,8 @@ async def send_pack_invoice(chat_id: int, pack_key: str) -> None:
 
 @dp.pre_checkout_query()
 async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery):
-    await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+    error = check_pre_checkout(pre_checkout_query)
+    await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=error is None, error_message=error)
 
 
 @dp.message(F.successful_payment)
@@ -757,37 +2204,580 @@ async def successful_payment(message: types.Message):
     payload = sp.invoice_payload
     user_id = message.from_user.id
 
+    if not await record_payment(user_id, sp):
+        entry = _payment_charges[sp.telegram_payment_charge_id]
+        with payment_priority():
+            if entry.get("applied"):
+                await message.answer("✅ Цей платіж уже зараховано.", reply_markup=MAIN_MENU_KB)
+            else:
+                # перший апдейт ще нараховує (або впав — тоді дорахує reconcile_payments)
+                await message.answer("⏳ Цей платіж ще зараховується. Загляни в /start за хвилину.")
+        return
+
+    # відповідаємо лише коли кредити вже на диску
+    st = await apply_payment(_payment_charges[sp.telegram_payment_charge_id])
+
     if payload in PACKS:
         pack = PACKS[payload]
-        st = await add_credits(user_id, credits=pack["credits"], natal=pack.get("natal", False))
 
         total = sp.total_amount / 100
         natal_txt = "\n🪐 *Натальна карта* відкрита." if pack.get("natal", False) else ""
 
-        await message.answer(
-            "✅✨ *Оплату прийнято! Магія активована.* ✨\n\n"
-            f"💳 Сума: *{total:.2f} {sp.currency}*\n"
-            f"🎴 Нараховано: *{pack['credits']} ворожінь*{natal_txt}\n"
-            f"📿 Баланс ворожінь: *{st['credits']}*\n\n"
-            "Скажи… з чого почнемо? 🔮",
-            parse_mode="Markdown",
-            reply_markup=get_main_menu(),
-        )
+        with payment_priority():
+            await message.answer(
+                "✅✨ *Оплату прийнято! Магія активована.* ✨\n\n"
+                f"💳 Сума: *{total:.2f} {sp.currency}*\n"
+                f"🎴 Нараховано: *{pack['credits']} ворожінь*{natal_txt}\n"
+                f"📿 Баланс ворожінь: *{st.credits}*\n\n"
+                "Скажи… з чого почнемо? 🔮",
+                parse_mode="Markdown",
+                reply_markup=MAIN_MENU_KB,
+            )
         return
 
-    await message.answer("✅ Оплату отримано. Якщо доступ не активувався — напиши /start.")
+    with payment_priority():
+        await message.answer("✅ Оплату отримано. Якщо доступ не активувався — напиши /start.")
 
 
 # =========================
 # BOT LOGIC
 # =========================
-async def ritual_delay(message: types.Message):
-    await message.answer(
-        "Зосередься на своєму питанні…\n"
-        "Зроби вдих. І ще один.\n"
-        "Колода шепоче у темряві… ✨"
+RITUAL_SECONDS = float(os.getenv("RITUAL_SECONDS", "2"))
+
+
+def ritual_deadline() -> float:
+    """loop.time(), коли скінчиться ритуальна пауза, що почалась щойно.
+
+    prepare рахує його першим рядком: дедлайн заливки — це кінець ритуалу,
+    а не RITUAL_SECONDS після того, як витягнули карти й зібрали картинку.
+    """
+    return asyncio.get_running_loop().time() + RITUAL_SECONDS
+
+
+async def ritual_delay(message: types.Message, prepare=None, action: str = "upload_photo"):
+    """
+    Ритуальна пауза. prepare (корутина: витягнути карти, зібрати картинку,
+    залити її) виконується паралельно з паузою, поки в чаті видно chat action.
+    Повертаємось, коли минули і RITUAL_SECONDS, і підготовка; результат — що повернула prepare.
+    """
+    task = asyncio.ensure_future(prepare) if prepare is not None else None
+    try:
+        await message.answer(
+            "Зосередься на своєму питанні…\n"
+            "Зроби вдих. І ще один.\n"
+            "Колода шепоче у темряві… ✨"
+        )
+        if task is None:
+            await asyncio.sleep(RITUAL_SECONDS)
+            return None
+        async with ChatActionSender(bot=message.bot, chat_id=message.chat.id, action=action):
+            await asyncio.gather(asyncio.sleep(RITUAL_SECONDS), task)
+        return task.result()
+    finally:
+        if task is not None and not task.done():
+            task.cancel()
+
+
+# =========================
+# CARD IMAGES: IN-MEMORY STORE
+# =========================
+# Прямі картки читаються з диска один раз на старті; перевернуті рендеряться
+# ліниво (поворот + JPEG у воркер-потоці) і живуть в LRU, обмеженому байтами.
+# Хендлери більше не ходять у файлову систему на event loop.
+CARD_REV_CACHE_BYTES = int(os.getenv("CARD_REV_CACHE_MB", "8")) * 1024 * 1024
+
+
+class CardImage:
+    __slots__ = ("name", "key", "data")
+
+    def __init__(self, name: str, key: str | None, data: bytes):
+        self.name = name  # m00.jpg / m00_rev.jpg
+        self.key = key  # ключ для кешу file_id: "<path>:<sha1 джерела>"; None — не кешувати
+        self.data = data
+
+    def input_file(self) -> BufferedInputFile:
+        return BufferedInputFile(self.data, filename=self.name)
+
+
+def _rev_name(name: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}_rev{ext}"
+
+
+def _render_reversed_sync(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as im:
+        out = io.BytesIO()
+        im.rotate(180, expand=True).save(out, format="JPEG", quality=92, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class CardImageStore:
+    """Байти картинок карт. Який файл стоїть за картою, вирішує лише CardEntry.path."""
+
+    def __init__(self, rev_cache_bytes: int):
+        self.rev_cache_bytes = rev_cache_bytes
+        self._entries: dict[tuple[str, bool], "CardEntry"] = {}
+        self._upright: dict[str, CardImage] = {}
+        self._rev: OrderedDict[str, CardImage] = OrderedDict()
+        self._rev_bytes = 0
+        self._rev_inflight: dict[str, asyncio.Future] = {}
+        self.rev_hits = 0
+        self.rev_renders = 0
+
+    @staticmethod
+    def _load_sync() -> dict[str, CardImage]:
+        images = {}
+        for card in DECK:
+            if card.reversed or not card.available:
+                continue
+            data = Path(card.path).read_bytes()
+            images[card.image] = CardImage(card.image, f"{card.path}:{hashlib.sha1(data).hexdigest()}", data)
+        return images
+
+    async def load(self) -> None:
+        self._entries = {(card.image, card.reversed): card for card in DECK}
+        self._upright = await asyncio.to_thread(self._load_sync)
+
+    def names(self) -> list[str]:
+        return sorted(self._upright)
+
+    @staticmethod
+    def _rendered_rev_key(src: CardImage) -> str:
+        path, digest = src.key.rsplit(":", 1)
+        # перевернута похідна від прямої — той самий хеш джерела
+        return f"{os.path.join(os.path.dirname(path), _rev_name(src.name))}:{digest}"
+
+    def key_sync(self, name: str, reversed_: bool = False) -> str | None:
+        """Ключ file_id-кешу без рендеру: для перевернутої — від джерела, а не від JPEG."""
+        src = self._upright.get(name)
+        if src is None or not reversed_:
+            return src.key if src else None
+        card = self._entries.get((name, True))
+        if card is None or not card.available:
+            return None
+        if card.rotate:
+            return self._rendered_rev_key(src)
+        try:
+            return f"{card.path}:{hashlib.sha1(Path(card.path).read_bytes()).hexdigest()}"
+        except OSError:
+            return None
+
+    def _reversed_sync(self, src: CardImage) -> CardImage:
+        card = self._entries[(src.name, True)]
+        if not card.rotate:
+            # готові *_rev.jpg від scripts/make_reversed_cards.py (або без Pillow)
+            data = Path(card.path).read_bytes()
+            return CardImage(_rev_name(src.name), f"{card.path}:{hashlib.sha1(data).hexdigest()}", data)
+        return CardImage(_rev_name(src.name), self._rendered_rev_key(src), _render_reversed_sync(src.data))
+
+    async def get(self, name: str, reversed_: bool = False) -> CardImage | None:
+        src = self._upright.get(name)
+        if src is None or not reversed_:
+            return src
+
+        img = self._rev.get(name)
+        if img is not None:
+            self.rev_hits += 1
+            self._rev.move_to_end(name)
+            return img
+
+        fut = self._rev_inflight.get(name)
+        if fut is None:
+            fut = self._rev_inflight[name] = asyncio.ensure_future(self._render_rev(name, src))
+        return await asyncio.shield(fut)
+
+    async def _render_rev(self, name: str, src: CardImage) -> CardImage:
+        try:
+            img = await asyncio.to_thread(self._reversed_sync, src)
+        finally:
+            self._rev_inflight.pop(name, None)
+        self.rev_renders += 1
+        self._remember_rev(name, img)
+        return img
+
+    def _remember_rev(self, name: str, img: CardImage) -> None:
+        self._rev[name] = img
+        self._rev_bytes += len(img.data)
+        while self._rev_bytes > self.rev_cache_bytes and len(self._rev) > 1:
+            _, old = self._rev.popitem(last=False)
+            self._rev_bytes -= len(old.data)
+
+
+card_images = CardImageStore(CARD_REV_CACHE_BYTES)
+
+
+async def get_card_image(card: "CardEntry") -> CardImage | None:
+    if not card.available:
+        return None
+    return await card_images.get(card.image, reversed_=card.reversed)
+
+
+# =========================
+# CARD IMAGES: FILE_ID CACHE
+# =========================
+# Після першого аплоаду Telegram повертає file_id — далі шлемо його замість
+# повторного завантаження JPEG. Ключ — шлях + хеш вмісту, тож змінена картинка
+# автоматично отримає новий аплоад.
+FILE_ID_CACHE_PATH = Path(os.getenv("FILE_ID_CACHE_PATH", "file_ids.json"))
+_file_ids: dict[str, str] = {}  # "<path>:<sha1>" -> Telegram file_id
+_file_ids_save_lock = asyncio.Lock()
+
+
+def _load_file_ids_sync() -> dict[str, str]:
+    if not FILE_ID_CACHE_PATH.exists():
+        return {}
+    try:
+        return json.loads(FILE_ID_CACHE_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def _save_file_ids_sync(file_ids: dict[str, str]) -> dict[str, str]:
+    # з WORKERS>1 файл пишуть кілька процесів — доливаємо чуже, а не затираємо
+    merged = {**_load_file_ids_sync(), **file_ids}
+    tmp = FILE_ID_CACHE_PATH.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(merged, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(FILE_ID_CACHE_PATH)
+    return merged
+
+
+async def load_file_ids() -> None:
+    _file_ids.clear()
+    _file_ids.update(await asyncio.to_thread(_load_file_ids_sync))
+
+
+async def remember_file_ids(pairs: list[tuple[str, str]]) -> None:
+    changed = False
+    for key, file_id in pairs:
+        if _file_ids.get(key) != file_id:
+            _file_ids[key] = file_id
+            changed = True
+    if changed:
+        async with _file_ids_save_lock:
+            merged = await asyncio.to_thread(_save_file_ids_sync, dict(_file_ids))
+        for key, file_id in merged.items():
+            _file_ids.setdefault(key, file_id)
+
+
+def _is_stale_file_id(e: TelegramBadRequest) -> bool:
+    msg = e.message.lower()
+    return "file identifier" in msg or "file_id" in msg or "file reference" in msg
+
+
+async def answer_card_photo(message: types.Message, image: CardImage, **kwargs) -> types.Message:
+    if image.key is None:
+        return await message.answer_photo(image.input_file(), **kwargs)
+
+    file_id = _file_ids.get(image.key)
+    if file_id:
+        try:
+            return await message.answer_photo(file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_stale_file_id(e):
+                raise
+            _file_ids.pop(image.key, None)  # протух — завантажимо заново
+
+    sent = await message.answer_photo(image.input_file(), **kwargs)
+    await remember_file_ids([(image.key, sent.photo[-1].file_id)])
+    return sent
+
+
+async def answer_card_album(
+    message: types.Message, images: list[CardImage], caption: str | None = None, parse_mode: str | None = None,
+) -> list[types.Message]:
+    def build_media() -> list[types.InputMediaPhoto]:
+        # підпис альбому — це підпис першого фото
+        return [
+            types.InputMediaPhoto(
+                media=_file_ids.get(img.key) or img.input_file(),
+                **({"caption": caption, "parse_mode": parse_mode} if i == 0 and caption else {}),
+            )
+            for i, img in enumerate(images)
+        ]
+
+    try:
+        sent = await message.answer_media_group(build_media())
+    except TelegramBadRequest as e:
+        if not _is_stale_file_id(e) or not any(img.key in _file_ids for img in images):
+            raise
+        # не знаємо, який саме id протух — перезаливаємо весь альбом
+        for img in images:
+            _file_ids.pop(img.key, None)
+        sent = await message.answer_media_group(build_media())
+
+    await remember_file_ids([(img.key, m.photo[-1].file_id) for img, m in zip(images, sent) if m.photo])
+    return sent
+
+
+# =========================
+# CARD IMAGES: SPREAD RENDERER
+# =========================
+# Замість альбому з 3/10 фото шлемо одну картинку, складену у формі розкладу.
+# Pillow працює в окремих процесах (ProcessPoolExecutor над spread_render.py),
+# готові зображення кешуються за впорядкованим набором (файл карти, поворот).
+SPREAD_COMPOSITE = os.getenv("SPREAD_COMPOSITE", "1") == "1"
+SPREAD_RENDER_WORKERS = int(os.getenv("SPREAD_RENDER_WORKERS", "2"))  # на весь бот, не на процес
+SPREAD_CACHE_SIZE = int(os.getenv("SPREAD_CACHE_SIZE", "64"))
+
+_spread_pool: ProcessPoolExecutor | None = None
+_spread_cache: OrderedDict[tuple, CardImage] = OrderedDict()
+_spread_inflight: dict[tuple, asyncio.Future] = {}
+
+
+@contextlib.contextmanager
+def _spawn_main(module):
+    """spawn запускає в дитині __main__ батька — тобто весь main.py з aiogram (~4 с і
+    ~160 МБ на процес). На час старту дітей підміняємо __main__ легким модулем."""
+    saved = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = saved
+
+
+def spread_pool_size() -> int:
+    # SPREAD_RENDER_WORKERS — на весь бот; з WORKERS>1 ділимо між процесами
+    return max(1, -(-SPREAD_RENDER_WORKERS // max(1, WORKERS)))
+
+
+async def start_spread_pool() -> None:
+    """Піднімає й прогріває пул на старті, щоб перші розклади не чекали на spawn."""
+    global _spread_pool
+    if _spread_pool is not None or not SPREAD_COMPOSITE or spread_render is None:
+        return
+    size = spread_pool_size()
+    # spawn, а не fork: форк процесу з потоками (to_thread, aiohttp) іноді лишав
+    # воркер у дедлоку, і вихід зависав на join пулу
+    pool = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+    # пул із spawn стартує процес на кожен submit, поки немає вільних, — усі size
+    # процесів народжуються тут, під підміненим __main__
+    with _spawn_main(spread_render):
+        warming = [pool.submit(spread_render.warm) for _ in range(size)]
+    _spread_pool = pool
+    await asyncio.gather(*(asyncio.wrap_future(f) for f in warming))
+    print(f"🖼 spread render pool: {size} process(es)")
+
+
+def shutdown_spread_pool() -> None:
+    global _spread_pool
+    if _spread_pool is not None:
+        _spread_pool.shutdown(wait=False, cancel_futures=True)
+        _spread_pool = None
+
+
+async def _render_spread(key: tuple) -> CardImage:
+    layout, cards = key
+    loop = asyncio.get_running_loop()
+    try:
+        await start_spread_pool()  # якщо на старті не підняли (напр., скрипти)
+        data = await loop.run_in_executor(_spread_pool, spread_render.render_spread_sync, layout, cards)
+    finally:
+        _spread_inflight.pop(key, None)
+    # key=None: композиції майже не повторюються, тож file_id для них не зберігаємо
+    img = CardImage(f"spread_{layout}.jpg", None, data)
+    _spread_cache[key] = img
+    while len(_spread_cache) > SPREAD_CACHE_SIZE:
+        _spread_cache.popitem(last=False)
+    return img
+
+
+async def render_spread(layout: str, cards: list["CardEntry"]) -> CardImage | None:
+    """Одна картинка з усіма картами розкладу; None -> шлемо звичайний альбом."""
+    if not SPREAD_COMPOSITE or spread_render is None:
+        return None
+    if not all(card.available for card in cards):
+        return None
+
+    # ключ — рівно те, що піде в рендерер: файл карти і чи крутити його на 180°
+    key = (layout, tuple((card.path, card.rotate) for card in cards))
+    img = _spread_cache.get(key)
+    if img is not None:
+        _spread_cache.move_to_end(key)
+        return img
+    fut = _spread_inflight.get(key)
+    if fut is None:
+        fut = _spread_inflight[key] = asyncio.ensure_future(_render_spread(key))
+    return await asyncio.shield(fut)
+
+
+async def prepare_spread_images(layout: str, cards: list["CardEntry"]) -> list[CardImage]:
+    """[зведена картинка] або картинки окремих карт для альбому."""
+    try:
+        spread = await render_spread(layout, cards)
+    except Exception as e:
+        print(f"⚠️ spread render failed: {e!r}")
+        spread = None
+    if spread is not None:
+        return [spread]
+    return [img for img in await asyncio.gather(*(get_card_image(card) for card in cards)) if img]
+
+
+async def send_spread_images(
+    message: types.Message, images: list[CardImage], caption: str | None = None, parse_mode: str | None = None,
+    reply_markup=None,
+) -> None:
+    """reply_markup — лише для одного фото: альбом клавіатуру не несе."""
+    if len(images) == 1:
+        await answer_card_photo(message, images[0], caption=caption, parse_mode=parse_mode, reply_markup=reply_markup)
+    elif images:
+        await answer_card_album(message, images, caption=caption, parse_mode=parse_mode)
+
+
+# =========================
+# CARD IMAGES: PREWARM
+# =========================
+# Заздалегідь заливаємо всю колоду у службовий чат, щоб file_id були в кеші
+# ще до першого реального ворожіння. Повторний запуск пропускає вже закешоване.
+STORAGE_CHAT_ID = int(os.getenv("STORAGE_CHAT_ID", "0")) or None
+PREWARM_ON_START = os.getenv("PREWARM_ON_START", "0") == "1"
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "3"))
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "3.0"))  # сек між аплоадами (групи: ~20 повідомлень/хв)
+_prewarm_task: asyncio.Task | None = None
+
+
+async def prewarm_file_ids(progress=None) -> dict:
+    if STORAGE_CHAT_ID is None:
+        raise RuntimeError("STORAGE_CHAT_ID is not set")
+
+    variants = [(name, rev) for name in card_images.names() for rev in (False, True)]
+    # ключі рахуємо без рендеру: 78 перевернутих JPEG не влазять у LRU, і upload()
+    # рендерив би їх удруге
+    keys = await asyncio.to_thread(lambda: [card_images.key_sync(name, rev) for name, rev in variants])
+    todo = [variant for variant, key in zip(variants, keys) if key is not None and key not in _file_ids]
+
+    stats = {"total": len(variants), "cached": len(variants) - len(todo), "uploaded": 0, "failed": 0, "bytes": 0}
+    sem = asyncio.Semaphore(PREWARM_CONCURRENCY)
+    pace = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    next_slot = loop.time()
+
+    async def wait_slot() -> None:
+        nonlocal next_slot
+        async with pace:
+            delay = next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_slot = loop.time() + PREWARM_INTERVAL
+
+    async def upload(name: str, rev: bool) -> None:
+        async with sem:
+            # перевернуті беремо з LRU по черзі, а не тримаємо всі в пам'яті
+            img = await card_images.get(name, reversed_=rev)
+            for _ in range(5):
+                await wait_slot()
+                try:
+                    sent = await bot.send_photo(STORAGE_CHAT_ID, img.input_file(), disable_notification=True)
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except Exception as e:
+                    print(f"⚠️ prewarm {img.name}: {e!r}")
+                    break
+                await remember_file_ids([(img.key, sent.photo[-1].file_id)])
+                stats["uploaded"] += 1
+                stats["bytes"] += len(img.data)
+                if progress:
+                    await progress(stats)
+                return
+            stats["failed"] += 1
+
+    await asyncio.gather(*(upload(name, rev) for name, rev in todo))
+    return stats
+
+
+_preupload_inflight: dict[str, asyncio.Task] = {}
+
+
+async def _preupload(img: CardImage) -> None:
+    try:
+        sent = await bot.send_photo(STORAGE_CHAT_ID, img.input_file(), disable_notification=True)
+        await remember_file_ids([(img.key, sent.photo[-1].file_id)])
+    except Exception as e:
+        print(f"⚠️ preupload {img.name}: {e!r}")
+    finally:
+        _preupload_inflight.pop(img.key, None)
+
+
+async def preupload_images(images: list[CardImage], deadline: float) -> None:
+    """
+    Під час ритуалу заливаємо ще не закешовані картинки у STORAGE_CHAT_ID,
+    щоб фінальна відправка пішла вже по file_id. Чекаємо не довше deadline
+    (loop.time(), див. ritual_deadline): недолиті продовжують у фоні, а
+    користувачу шлемо як є.
+    """
+    if STORAGE_CHAT_ID is None:
+        return
+    tasks = []
+    for img in images:
+        if img.key is None or img.key in _file_ids:
+            continue
+        task = _preupload_inflight.get(img.key)
+        if task is None:
+            task = _preupload_inflight[img.key] = asyncio.create_task(_preupload(img))
+        tasks.append(task)
+    timeout = deadline - asyncio.get_running_loop().time()
+    if tasks and timeout > 0:
+        await asyncio.wait(tasks, timeout=timeout)
+
+
+def _prewarm_summary(stats: dict) -> str:
+    done = stats["cached"] + stats["uploaded"]
+    return (
+        f"{done}/{stats['total']} cached, uploaded={stats['uploaded']} "
+        f"failed={stats['failed']} bytes={stats['bytes'] / 1024 / 1024:.1f} MB"
     )
-    await asyncio.sleep(2)
+
+
+async def _prewarm_on_start() -> None:
+    async def progress(stats: dict) -> None:
+        if stats["uploaded"] % 20 == 0:
+            print(f"🃏 prewarm: {_prewarm_summary(stats)}")
+
+    try:
+        stats = await prewarm_file_ids(progress)
+        print(f"🃏 prewarm done: {_prewarm_summary(stats)}")
+    except Exception as e:
+        print(f"⚠️ prewarm failed: {e!r}")
+
+
+@dp.message(Command("prewarm"))
+async def cmd_prewarm(message: types.Message):
+    global _prewarm_task
+    if not is_admin(message.from_user.id):
+        return
+    if STORAGE_CHAT_ID is None:
+        await message.answer("STORAGE_CHAT_ID is not set")
+        return
+    if _prewarm_task and not _prewarm_task.done():
+        await message.answer("Prewarm is already running")
+        return
+
+    status = await message.answer("🃏 Prewarm started…")
+
+    async def progress(stats: dict) -> None:
+        if stats["uploaded"] % 10 != 0:
+            return
+        try:
+            await status.edit_text(f"🃏 Prewarm: {_prewarm_summary(stats)}")
+        except Exception as e:  # "message is not modified", флуд-ліміт — прогрів важливіший
+            print(f"⚠️ prewarm progress: {e!r}")
+
+    async def run() -> None:
+        # результат задачі ніхто не читає, тож помилку треба показати самим
+        try:
+            stats = await prewarm_file_ids(progress)
+        except Exception as e:
+            print(f"⚠️ prewarm failed: {e!r}")
+            text = f"❌ Prewarm failed: {e!r}"
+        else:
+            text = f"✅ Prewarm done: {_prewarm_summary(stats)}"
+        try:
+            await status.edit_text(text)
+        except Exception as e:
+            print(f"⚠️ prewarm status: {e!r}")
+
+    _prewarm_task = asyncio.create_task(run())
 
 
 def code_to_img_base(code: str) -> str:
@@ -802,25 +2792,242 @@ def code_to_img_base(code: str) -> str:
     return f"{prefix}{rank:02d}.jpg"
 
 
-def get_random_card():
-    code = random.choice(ALL_CODES)
-    orient = random.choice(["up", "rev"])
+# =========================
+# DECK INDEX
+# =========================
+# Колода як незмінна таблиця з 156 записів (78 кодів × пряма/перевернута),
+# зібрана один раз на старті. Витягнути карту = один цілий індекс у DECK.
+ORIENTS = ("up", "rev")
+
+
+class CardEntry:
+    __slots__ = ("index", "code", "orient", "reversed", "name", "meaning", "emoji", "label",
+                 "text", "caption", "image", "path", "rotate", "available")
+
+    def __init__(self, index: int, code: str, orient: str):
+        self.index = index
+        self.code = code
+        self.orient = orient
+        self.reversed = orient == "rev"
+        self.name = NAMES[code]
+        self.meaning = MEANINGS[code][orient]
+        self.emoji = "🌙" if self.reversed else "✨"
+        self.label = "(перевернута)" if self.reversed else "(пряма)"
+        # готові Markdown-фрагменти: блок карти в розкладі та підпис для "однієї карти"
+        self.text = f"{self.emoji} *{self.name}* {self.label}\n{self.meaning}\n\n"
+        self.caption = (
+            f"{self.emoji} *{self.name}* {self.label}\n\n"
+            f"{self.meaning}\n\n"
+            "Дихай. Відповідь уже поруч."
+        )
+        self.image = code_to_img_base(code)  # пряма картинка; перевернута рендериться з неї
+        # path — єдине джерело правди про файл карти для CardImageStore і рендера розкладу;
+        # rotate — перевернуту робимо поворотом path (готового *_rev.jpg немає)
+        self.path, self.rotate, self.available = _resolve_card_image(self.image, self.reversed)
+
+    def __repr__(self) -> str:
+        return f"CardEntry({self.index}, {self.code!r}, {self.orient!r})"
+
+
+def _resolve_card_image(image: str, reversed_: bool) -> tuple[str | None, bool, bool]:
+    """(path, rotate, available): спершу пережатий tg-варіант, далі оригінал;
+    перевернуту без готового файлу рендеримо з прямої (якщо є Pillow)."""
+    upright = [os.path.join(CARDS_FOLDER, "tg", image), os.path.join(CARDS_FOLDER, image)]
+    if not reversed_:
+        candidates = [(path, False) for path in upright]
+    else:
+        rev = _rev_name(image)
+        candidates = [(os.path.join(CARDS_FOLDER, "tg", rev), False)]
+        if Image is not None:
+            candidates += [(path, True) for path in upright]
+        else:
+            candidates.append((os.path.join(CARDS_FOLDER, rev), False))
+    for path, rotate in candidates:
+        if os.path.exists(path):
+            return path, rotate, True
+    return None, False, False
+
+
+def build_deck_index() -> tuple[CardEntry, ...]:
+    missing_meanings = sorted(set(NAMES) ^ set(MEANINGS))
+    if missing_meanings:
+        raise RuntimeError(f"NAMES/MEANINGS mismatch for codes: {missing_meanings}")
+    for code, meanings in MEANINGS.items():
+        if set(meanings) != set(ORIENTS):
+            raise RuntimeError(f"MEANINGS[{code!r}] must have exactly {ORIENTS}")
+
+    deck = tuple(
+        CardEntry(i * len(ORIENTS) + j, code, orient)
+        for i, code in enumerate(ALL_CODES)
+        for j, orient in enumerate(ORIENTS)
+    )
+    missing_images = [f"{e.code}/{e.orient}" for e in deck if not e.available]
+    if missing_images:
+        print(f"⚠️ no images for {len(missing_images)} cards: {', '.join(missing_images)}")
+    return deck
+
+
+DECK = build_deck_index()
+
+# SPREAD_BLOCKS[layout][position][card.index] -> "<позиція>\n<блок карти>"
+SPREAD_BLOCKS = {
+    layout: tuple(tuple(f"{pos}\n{card.text}" for card in DECK) for pos in positions)
+    for layout, positions in (("three", THREE_CARDS_POSITIONS), ("celtic", CELTIC_CROSS_POSITIONS))
+}
+
+
+def spread_blocks(layout: str, cards: list[CardEntry]) -> list[str]:
+    table = SPREAD_BLOCKS[layout]
+    return [table[i][card.index] for i, card in enumerate(cards)]
+
+
+# =========================
+# DRAW ENGINE
+# =========================
+class DrawEngine:
+    """Точне витягування k різних карт без повторів за O(k), орієнтація — для кожної окремо.
+
+    RNG підставляється ззовні: random.Random(seed) для тестів і відтворення,
+    secrets.SystemRandom() у проді.
+    """
+
+    def __init__(self, rng: random.Random | None = None):
+        self.rng = rng if rng is not None else secrets.SystemRandom()
+
+    @classmethod
+    def seeded(cls, seed) -> "DrawEngine":
+        return cls(random.Random(seed))
+
+    def one(self) -> CardEntry:
+        return DECK[self.rng.randrange(len(DECK))]
 
-    base = code_to_img_base(code)
-    if orient == "rev":
-        # expects pre-generated rotated images like m00_rev.jpg, c01_rev.jpg, ...
-        base = base.replace(".jpg", "_rev.jpg")
+    def draw(self, k: int) -> list[CardEntry]:
+        n_codes = len(ALL_CODES)
+        if not 0 <= k <= n_codes:
+            raise ValueError(f"can't draw {k} unique cards from {n_codes}")
+        codes = self.rng.sample(range(n_codes), k)  # range не матеріалізується — O(k)
+        bits = self.rng.getrandbits(k) if k else 0
+        return [DECK[code * len(ORIENTS) + ((bits >> i) & 1)] for i, code in enumerate(codes)]
 
-    path = os.path.join(CARDS_FOLDER, base)
-    return code, orient, path
+    def batch(self, n: int, k: int, seed=None):
+        """N розкладів по k карт одразу: (codes, orients) — numpy-масиви форми (n, k).
+
+        codes — індекси в ALL_CODES, orients — 0/1 (up/rev); індекс у DECK = codes * 2 + orients.
+        """
+        import numpy as np
+
+        n_codes = len(ALL_CODES)
+        if not 0 < k <= n_codes:
+            raise ValueError(f"can't draw {k} unique cards from {n_codes}")
+        g = np.random.default_rng(seed if seed is not None else self.rng.getrandbits(128))
+        # k найменших випадкових ключів у рядку = випадкова k-вибірка без повторів,
+        # а сортування цих ключів дає ще й випадковий порядок позицій
+        keys = g.random((n, n_codes), dtype=np.float32)
+        idx = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(keys, idx, axis=1), axis=1)
+        codes = np.take_along_axis(idx, order, axis=1).astype(np.int16)
+        orients = g.integers(0, len(ORIENTS), size=(n, k), dtype=np.int8)
+        return codes, orients
+
+
+DRAW_SEED = os.getenv("DRAW_SEED")  # задати для відтворюваних розкладів (dev/replay)
+draw_engine = DrawEngine.seeded(int(DRAW_SEED)) if DRAW_SEED else DrawEngine()
+
+
+def get_random_card() -> CardEntry:
+    return draw_engine.one()
+
+
+# =========================
+# MESSAGE PACKING
+# =========================
+# Текст розкладу — це послідовність цілих блоків (заголовок, карта, порада,
+# трейлер). Ріжемо лише між блоками, тож *жирний* чи _курсив_ ніколи не
+# розривається, а блоки пакуємо в мінімум повідомлень.
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+
+def tg_len(text: str) -> int:
+    """Довжина в UTF-16, як рахує Telegram; розмітку не віднімаємо — виходить із запасом."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+# довжини всіх заготовлених фрагментів рахуємо один раз
+FRAGMENT_LEN: dict[str, int] = {
+    fragment: tg_len(fragment)
+    for fragment in (
+        THREE_CARDS_HEADER, THREE_CARDS_TRAILER, CELTIC_CROSS_HEADER, CELTIC_CROSS_TRAILER,
+        *(block for table in SPREAD_BLOCKS.values() for row in table for block in row),
+    )
+}
+
+
+def _split_block(block: str, limit: int) -> list[str]:
+    """Запасний варіант для блоку, що сам не влазить: ріжемо між рядками (спани в нас однорядкові)."""
+    parts, cur = [], ""
+    for line in block.splitlines(keepends=True):
+        if cur and tg_len(cur + line) > limit:
+            parts.append(cur)
+            cur = ""
+        cur += line
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def pack_blocks(blocks: list[str], first_limit: int = TEXT_LIMIT, limit: int = TEXT_LIMIT) -> list[str]:
+    """
+    Жадібно склеює блоки в частини не довші за limit. Перша частина обмежена
+    first_limit (CAPTION_LIMIT, якщо йде підписом до фото) і буває порожньою,
+    коли туди не влазить навіть перший блок.
+    """
+    parts: list[str] = []
+    cur: list[str] = []
+    cur_len = 0
+    for block in blocks:
+        n = FRAGMENT_LEN.get(block) or tg_len(block)
+        if cur_len + n <= (first_limit if not parts else limit):
+            cur.append(block)
+            cur_len += n
+            continue
+        parts.append("".join(cur).rstrip())
+        if n > limit:
+            *head, block = _split_block(block, limit)
+            parts.extend(part.rstrip() for part in head)
+            n = tg_len(block)
+        cur, cur_len = [block], n
+    parts.append("".join(cur).rstrip())
+    return parts
+
+
+async def send_reading(
+    message: types.Message, images: list[CardImage], blocks: list[str], reply_markup=None,
+) -> None:
+    """Картинки розкладу + текст мінімумом повідомлень: що влазить — у підпис, решта — текстом."""
+    if not images:
+        caption, parts = None, [part for part in pack_blocks(blocks) if part]
+    else:
+        # альбом не несе reply_markup: тоді весь текст іде повідомленнями, клавіатура — з останнім
+        album_with_kb = len(images) > 1 and reply_markup is not None
+        caption, *parts = pack_blocks(blocks, first_limit=0 if album_with_kb else CAPTION_LIMIT)
+        await send_spread_images(
+            message, images, caption=caption or None, parse_mode="Markdown",
+            reply_markup=None if parts else reply_markup,
+        )
+    for i, part in enumerate(parts):
+        await message.answer(
+            part, parse_mode="Markdown",
+            reply_markup=reply_markup if i == len(parts) - 1 else None,
+        )
 
 
 @dp.message(Command("start"))
 async def start(message: types.Message):
     st = await get_user_state(message.from_user.id)
-    free_left = max(0, FREE_READINGS - int(st.get("free_used", 0)))
-    credits = int(st.get("credits", 0))
-    natal = bool(st.get("natal", False))
+    free_left = max(0, FREE_READINGS - st.free_used)
+    credits = st.credits
+    natal = st.natal
 
     await message.answer(
         "✨ Я — маг-таролог. Я слухаю твоє питання і читаю знаки… 🧙‍♂️🔮\n\n"
@@ -829,7 +3036,7 @@ async def start(message: types.Message):
         f"🪐 Натальна карта: *{'доступна' if natal else 'закрита'}*\n\n"
         "Обери ритуал:",
         parse_mode="Markdown",
-        reply_markup=get_main_menu(),
+        reply_markup=MAIN_MENU_KB,
     )
 
 
@@ -854,7 +3061,7 @@ async def show_paywall(message: types.Message):
     await message.answer(
         "🧙‍♂️💫 *Обери пакунок сили:*",
         parse_mode="Markdown",
-        reply_markup=get_paywall_kb(),
+        reply_markup=PAYWALL_KB,
     )
 
 
@@ -864,7 +3071,7 @@ async def cb_buy_pack_5(callback: types.CallbackQuery):
     await callback.message.answer(
         DISCLAIMER_TEXT + "\n\n✅ Якщо все зрозуміло — можеш продовжити до оплати:",
         parse_mode="Markdown",
-        reply_markup=get_disclaimer_confirm_kb("pack_5"),
+        reply_markup=DISCLAIMER_CONFIRM_KB["pack_5"],
     )
 
 
@@ -874,7 +3081,7 @@ async def cb_buy_pack_10(callback: types.CallbackQuery):
     await callback.message.answer(
         DISCLAIMER_TEXT + "\n\n✅ Якщо все зрозуміло — можеш продовжити до оплати:",
         parse_mode="Markdown",
-        reply_markup=get_disclaimer_confirm_kb("pack_10_natal"),
+        reply_markup=DISCLAIMER_CONFIRM_KB["pack_10_natal"],
     )
 
 
@@ -888,19 +3095,19 @@ async def cb_confirm_buy(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "back_menu")
 async def cb_back_menu(callback: types.CallbackQuery):
     await callback.answer()
-    await callback.message.answer("🔙 Повертаю в меню…", reply_markup=get_main_menu())
+    await callback.message.answer("🔙 Повертаю в меню…", reply_markup=MAIN_MENU_KB)
 
 
 @dp.message(F.text == "🪐 Натальна карта")
 async def natal_chart(message: types.Message):
     st = await get_user_state(message.from_user.id)
-    if not st.get("natal", False):
+    if not st.natal:
         await message.answer(
             "🪐🔒 *Натальна карта* зараз закрита печаттю зірок.\n\n"
             "Відкрию її тим, хто обере пакунок:\n"
             "🔮 *10 ворожінь + 🪐 Натальна карта* — і я розшифрую твій небесний код ✨",
             parse_mode="Markdown",
-            reply_markup=get_paywall_kb(),
+            reply_markup=PAYWALL_KB,
         )
         return
 
@@ -916,20 +3123,20 @@ async def one_card(message: types.Message):
     if not await consume_reading_or_block(message):
         return
 
-    await ritual_delay(message)
-    code, orient, path = get_random_card()
-    emoji = "✨" if orient == "up" else "🌙"
+    async def prepare():
+        deadline = ritual_deadline()
+        card = get_random_card()
+        image = await get_card_image(card)
+        if image:
+            await preupload_images([image], deadline)
+        return card, image
 
-    caption = (
-        f"{emoji} *{NAMES[code]}* {'(пряма)' if orient == 'up' else '(перевернута)'}\n\n"
-        f"{MEANINGS[code][orient]}\n\n"
-        "Дихай. Відповідь уже поруч."
-    )
+    card, image = await ritual_delay(message, prepare())
 
-    if os.path.exists(path):
-        await message.answer_photo(FSInputFile(path), caption=caption, parse_mode="Markdown")
+    if image:
+        await answer_card_photo(message, image, caption=card.caption, parse_mode="Markdown")
     else:
-        await message.answer(caption, parse_mode="Markdown")
+        await message.answer(card.caption, parse_mode="Markdown")
 
 
 @dp.message(F.text == "🃏 Три карти — шлях душі")
@@ -937,27 +3144,17 @@ async def three_cards(message: types.Message):
     if not await consume_reading_or_block(message):
         return
 
-    await ritual_delay(message)
-
-    cards = [get_random_card() for _ in range(3)]
-    media = []
-    text = "*Три карти — шлях душі*\n\n"
-    positions = ["🕰 Минуле", "🌟 Теперішнє", "🔮 Майбутнє"]
-
-    for i, (code, orient, path) in enumerate(cards):
-        emoji = "✨" if orient == "up" else "🌙"
-        text += (
-            f"{positions[i]}\n"
-            f"{emoji} *{NAMES[code]}* {'(пряма)' if orient == 'up' else '(перевернута)'}\n"
-            f"{MEANINGS[code][orient]}\n\n"
-        )
-        if os.path.exists(path):
-            media.append(types.InputMediaPhoto(media=FSInputFile(path)))
+    async def prepare():
+        deadline = ritual_deadline()
+        cards = draw_unique_cards(3)
+        images = await prepare_spread_images("three", cards)
+        await preupload_images(images, deadline)
+        return cards, images
 
-    if media:
-        await message.answer_media_group(media)
+    cards, images = await ritual_delay(message, prepare())
 
-    await message.answer(text + "Три нитки сплелись… шлях уже змінюється ✨", parse_mode="Markdown")
+    blocks = [THREE_CARDS_HEADER, *spread_blocks("three", cards), THREE_CARDS_TRAILER]
+    await send_reading(message, images, blocks)
 
 
 @dp.message(F.text == "✨ Кельтський хрест — повне ворожіння")
@@ -969,7 +3166,7 @@ async def celtic_cross_start(message: types.Message):
             "🔒 Щоб зробити *Кельтський хрест*, потрібне ворожіння на балансі.\n"
             "Обери пакет нижче 👇",
             parse_mode="Markdown",
-            reply_markup=get_paywall_kb(),
+            reply_markup=PAYWALL_KB,
         )
         return
 
@@ -985,7 +3182,7 @@ async def celtic_cross_start(message: types.Message):
 @dp.message(PendingKind("celtic_cross"), F.text == "❌ Скасувати")
 async def celtic_cross_cancel(message: types.Message):
     await clear_pending(message.from_user.id)
-    await message.answer("Добре, скасувала ✅", reply_markup=get_main_menu())
+    await message.answer("Добре, скасувала ✅", reply_markup=MAIN_MENU_KB)
 
 
 @dp.message(PendingKind("celtic_cross"), F.text)
@@ -999,41 +3196,25 @@ async def celtic_cross_question(message: types.Message):
 
     # теперь реально списываем (бесплатное/кредит) и делаем расклад
     if not await consume_reading_or_block(message):
-        await message.answer("Повертаю в меню 👇", reply_markup=get_main_menu())
+        await message.answer("Повертаю в меню 👇", reply_markup=MAIN_MENU_KB)
         return
 
-    await ritual_delay(message)
-
-    cards = draw_unique_cards(10)
-
-    media = []
-    for (code, orient, path) in cards:
-        if os.path.exists(path):
-            media.append(types.InputMediaPhoto(media=FSInputFile(path)))
-    if media:
-        await message.answer_media_group(media)
-
-    text = (
-        "*✨ Кельтський хрест — повне ворожіння*\n"
-        f"*Запит:* _{md_escape(question)}_\n\n"
-    )
-
-    for i, (code, orient, path) in enumerate(cards):
-        emoji = "✨" if orient == "up" else "🌙"
-        text += (
-            f"{CELTIC_CROSS_POSITIONS[i]}\n"
-            f"{emoji} *{NAMES.get(code, code)}* {'(пряма)' if orient == 'up' else '(перевернута)'}\n"
-            f"{MEANINGS.get(code, {}).get(orient, '—')}\n\n"
-        )
-
-    text += "🧿 *Порада:* дивись на 1↔2 (конфлікт), 3↔5 (корінь↔намір), 7↔8 (ти↔оточення)."
+    async def prepare():
+        deadline = ritual_deadline()
+        cards = draw_unique_cards(10)
+        images = await prepare_spread_images("celtic", cards)
+        await preupload_images(images, deadline)
+        return cards, images
 
-    # Telegram лимит — режем по частям
-    chunk = 3500
-    for i in range(0, len(text), chunk):
-        await message.answer(text[i:i+chunk], parse_mode="Markdown")
+    cards, images = await ritual_delay(message, prepare())
 
-    await message.answer("Готово ✨", reply_markup=get_main_menu())
+    blocks = [
+        CELTIC_CROSS_HEADER,
+        f"*Запит:* _{md_escape(question[:1000])}_\n\n",  # запит — один рядок, не довший за повідомлення
+        *spread_blocks("celtic", cards),
+        CELTIC_CROSS_TRAILER,
+    ]
+    await send_reading(message, images, blocks, reply_markup=MAIN_MENU_KB)
 
 
 @dp.message(F.text == "❓ Так / Ні — швидка відповідь")
@@ -1050,10 +3231,223 @@ async def yes_no(message: types.Message):
     await message.answer(random.choice(answers))
 
 
+# =========================
+# WEBHOOK
+# =========================
+# BOT_MODE=webhook: апдейти приходять POST-ом на WEBHOOK_PATH (aiohttp-сервер на
+# WEBHOOK_PORT, на Railway це $PORT). Telegram одразу отримує 200, а сам апдейт
+# обробляється фоновою задачею.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")  # https://<app>.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # X-Telegram-Bot-Api-Secret-Token: A-Z a-z 0-9 _ -
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"Unknown BOT_MODE: {BOT_MODE!r} (expected 'polling' or 'webhook')")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise RuntimeError("WEBHOOK_SECRET is not set (required for BOT_MODE=webhook)")
+
+
+async def healthz(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def run_webhook(dispatcher: Dispatcher) -> None:
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    print(f"🌐 webhook: listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # без WEBHOOK_BASE_URL вебхук реєструє хтось інший (або локальний fake-клієнт)
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    # Railway зупиняє контейнер SIGTERM-ом: виходимо звичайним return, щоб у main()
+    # відпрацювали finally (флаш стану, метрики, пул рендера, воркери)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+        print("🛑 webhook: stopping…")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
+
+
+# =========================
+# WORKERS (scale-out)
+# =========================
+# WORKERS=N>1: головний процес лише приймає апдейти (polling або webhook) і
+# розкладає їх по N процесах-воркерах за user id. Усі апдейти одного юзера
+# потрапляють в один воркер і обробляються там строго по черзі. Стан спільний
+# через SQLite; LRU-кеш і _pending_index лишаються коректними, бо кожен юзер
+# живе рівно в одному воркері.
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+if WORKERS > 1 and STATE_BACKEND != "sqlite":
+    raise RuntimeError("WORKERS>1 requires STATE_BACKEND=sqlite (JSON state lives in one process)")
+
+
+def _update_user_id(update: types.Update) -> int:
+    try:
+        event = update.event
+    except Exception:  # невідомий тип апдейту
+        return 0
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else 0
+
+
+def shard_for(user_id: int) -> int:
+    return zlib.crc32(user_id.to_bytes(8, "little", signed=True)) % WORKERS
+
+
+async def _worker_loop(index: int, queue) -> None:
+    await load_state()
+    await load_payment_ledger(writer=False)  # хвіст журналу обрізає й звіряє лише головний процес
+    await load_file_ids()
+    await card_images.load()
+    await start_spread_pool()
+    await _store.start()
+    # кожен воркер — свій порт метрик: METRICS_PORT + index
+    metrics = await start_metrics_server(METRICS_PORT + index if METRICS_PORT else 0)
+    if index == 0 and PREWARM_ON_START and STORAGE_CHAT_ID is not None:
+        asyncio.create_task(_prewarm_on_start())
+    print(f"🧙‍♂️ worker {index} готовий…")
+
+    loop = asyncio.get_running_loop()
+    tails: dict[int, asyncio.Task] = {}  # user id -> останній апдейт цього юзера
+
+    async def process(data: dict, prev: asyncio.Task | None) -> None:
+        if prev is not None:
+            await asyncio.wait([prev])
+        try:
+            await dp.feed_update(bot, types.Update.model_validate(data, context={"bot": bot}))
+        except Exception as e:
+            print(f"⚠️ worker {index}: update {data.get('update_id')} failed: {e!r}")
+
+    def forget(uid: int, task: asyncio.Task) -> None:
+        if tails.get(uid) is task:
+            del tails[uid]
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            uid, data = item
+            task = tails[uid] = asyncio.create_task(process(data, tails.get(uid)))
+            task.add_done_callback(functools.partial(forget, uid))
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        if metrics:
+            await metrics.cleanup()
+        await _store.close()
+        shutdown_spread_pool()
+        await bot.session.close()
+
+
+def _worker_main(index: int, queue) -> None:
+    # зупиняємось лише по None з черги, дообробивши своє: Ctrl+C і SIGTERM на всю
+    # групу процесів ловить головний процес і сам розсилає None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    outbound.share_global(WORKERS)
+    asyncio.run(_worker_loop(index, queue))
+
+
+async def run_front() -> None:
+    # до старту воркерів, щоб вони не робили це навперейми: одноразова міграція
+    # JSON -> SQLite, обрізка обірваного хвоста журналу платежів і звірка платежів
+    await _store.load()
+    await load_payment_ledger()
+    await reconcile_payments()
+    await _store.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(WORKERS)]
+    procs = [
+        ctx.Process(target=_worker_main, args=(i, q), name=f"taro-worker-{i}")
+        for i, q in enumerate(queues)
+    ]
+    for p in procs:
+        p.start()
+
+    front = Dispatcher()
+
+    @front.update.outer_middleware()
+    async def route(handler, update: types.Update, data: dict):
+        uid = _update_user_id(update)
+        queues[shard_for(uid)].put((uid, update.model_dump(mode="json", exclude_unset=True, by_alias=True)))
+
+    print(f"🧙‍♂️ Бот готовий до ритуалу… ({WORKERS} workers)")
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(front)
+        else:
+            await bot.delete_webhook()
+            # route лише кладе в чергу, тож послідовна обробка зберігає порядок апдейтів
+            await front.start_polling(bot, handle_as_tasks=False, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        for q in queues:
+            q.put(None)
+        await asyncio.to_thread(lambda: [p.join(30) for p in procs])
+        for p in procs:
+            if p.is_alive():
+                print(f"⚠️ {p.name} did not stop in 30s, killing")
+                p.kill()  # SIGTERM воркери ігнорують
+        await asyncio.to_thread(lambda: [p.join() for p in procs])
+        await bot.session.close()
+
+
 async def main():
+    if WORKERS > 1:
+        await run_front()
+        return
     await load_state()
+    await load_payment_ledger()
+    await reconcile_payments()
+    await load_file_ids()
+    await card_images.load()
+    await start_spread_pool()
+    await _store.start()
+    metrics = await start_metrics_server()
+    if PREWARM_ON_START and STORAGE_CHAT_ID is not None:
+        asyncio.create_task(_prewarm_on_start())
     print("🧙‍♂️ Бот готовий до ритуалу…")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp)
+        else:
+            await bot.delete_webhook()  # інакше getUpdates отримає 409 після webhook-режиму
+            await dp.start_polling(bot)
+    finally:
+        if metrics:
+            await metrics.cleanup()
+        await _store.close()
+        shutdown_spread_pool()
 
 
 if __name__ == "__main__":
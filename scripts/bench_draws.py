@@ -0,0 +1,142 @@
+import argparse
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# main.py требует токены при импорте — для бенчмарка хватит заглушек
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("PROVIDER_TOKEN", "bench")
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+def chi_square(observed: np.ndarray) -> tuple[float, int, float]:
+    """Хи-квадрат против равномерного распределения: (stat, df, p-value)."""
+    observed = observed.astype(np.float64).ravel()
+    expected = observed.sum() / observed.size
+    stat = float(((observed - expected) ** 2 / expected).sum())
+    df = observed.size - 1
+    # Wilson–Hilferty: (X/df)^(1/3) ~ N(1 - 2/(9df), 2/(9df)) — без scipy
+    z = ((stat / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    p = 0.5 * math.erfc(z / math.sqrt(2))
+    return stat, df, p
+
+
+def duplicate_rows(codes: np.ndarray) -> int:
+    s = np.sort(codes, axis=1)
+    return int(np.any(s[:, 1:] == s[:, :-1], axis=1).sum())
+
+
+class Tally:
+    def __init__(self, k: int):
+        n_codes = len(main.ALL_CODES)
+        self.k = k
+        self.spreads = 0
+        self.duplicates = 0
+        self.per_card = np.zeros(n_codes, dtype=np.int64)
+        self.per_entry = np.zeros(len(main.DECK), dtype=np.int64)
+        self.per_position = np.zeros((k, n_codes), dtype=np.int64)
+
+    def add(self, codes: np.ndarray, orients: np.ndarray) -> None:
+        n_codes = len(main.ALL_CODES)
+        self.spreads += codes.shape[0]
+        self.duplicates += duplicate_rows(codes)
+        flat = codes.astype(np.int64)
+        self.per_card += np.bincount(flat.ravel(), minlength=n_codes)
+        self.per_entry += np.bincount((flat * 2 + orients).ravel(), minlength=len(main.DECK))
+        pos = np.arange(self.k, dtype=np.int64) * n_codes
+        self.per_position += np.bincount((flat + pos).ravel(), minlength=self.k * n_codes).reshape(self.k, n_codes)
+
+    def report(self, title: str, elapsed: float) -> None:
+        cards = self.spreads * self.k
+        print(f"\n== {title} ==")
+        print(f"spreads       : {self.spreads:,} x {self.k} cards in {elapsed:.2f}s")
+        print(f"throughput    : {self.spreads / elapsed:,.0f} spreads/s, {cards / elapsed:,.0f} cards/s")
+        print(f"dup spreads   : {self.duplicates:,} ({self.duplicates / max(self.spreads, 1):.4%})")
+
+        stat, df, p = chi_square(self.per_card)
+        print(f"per-card      : chi2={stat:.1f} df={df} p={p:.3f}  "
+              f"min/max share={self.per_card.min() / cards:.5f}/{self.per_card.max() / cards:.5f} "
+              f"(ideal {1 / len(self.per_card):.5f})")
+        stat, df, p = chi_square(self.per_entry)
+        print(f"card x orient : chi2={stat:.1f} df={df} p={p:.3f}")
+
+        # k тестов (по одному на позицию): наименьшее p умножаем на k (Бонферрони),
+        # иначе на 10 позициях «плохое» p выпадает просто случайно
+        worst = min(
+            ((i, *chi_square(row)) for i, row in enumerate(self.per_position)),
+            key=lambda t: t[3],
+        )
+        p_adj = min(1.0, worst[3] * self.k)
+        print(f"per-position  : worst position {worst[0] + 1}: chi2={worst[1]:.1f} df={worst[2]} "
+              f"p={worst[3]:.3f}, Bonferroni x{self.k} p={p_adj:.3f}")
+
+        top = np.argsort(self.per_card)[::-1][:3]
+        print("most drawn    : " + ", ".join(
+            f"{main.NAMES[main.ALL_CODES[i]]} ({self.per_card[i] / cards:.5f})" for i in top
+        ))
+
+
+def bench_scalar(k: int, spreads: int) -> None:
+    tally = Tally(k)
+    t0 = time.perf_counter()
+    drawn = [main.draw_unique_cards(k) for _ in range(spreads)]
+    elapsed = time.perf_counter() - t0
+    index = np.array([[card.index for card in spread] for spread in drawn], dtype=np.int16)
+    tally.add(index // 2, (index % 2).astype(np.int8))
+    tally.report(f"scalar draw_unique_cards({k})", elapsed)
+
+
+def bench_single(draws: int) -> None:
+    counts = np.zeros(len(main.DECK), dtype=np.int64)
+    t0 = time.perf_counter()
+    for _ in range(draws):
+        counts[main.get_random_card().index] += 1
+    elapsed = time.perf_counter() - t0
+    stat, df, p = chi_square(counts)
+    print("\n== scalar get_random_card() ==")
+    print(f"draws         : {draws:,} in {elapsed:.2f}s ({draws / elapsed:,.0f} cards/s)")
+    print(f"card x orient : chi2={stat:.1f} df={df} p={p:.3f}")
+
+
+def bench_batch(k: int, spreads: int, chunk: int, seed: int | None) -> None:
+    tally = Tally(k)
+    engine = main.draw_engine
+    rng_seed = np.random.SeedSequence(seed)
+    t0 = time.perf_counter()
+    done = 0
+    for child in rng_seed.spawn(math.ceil(spreads / chunk)):
+        n = min(chunk, spreads - done)
+        codes, orients = engine.batch(n, k, seed=child)
+        tally.add(codes, orients)
+        done += n
+    elapsed = time.perf_counter() - t0
+    tally.report(f"vectorized DrawEngine.batch(k={k})", elapsed)
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Fairness and throughput check for the card draw path.")
+    ap.add_argument("--spreads", type=int, default=10_000_000, help="spreads for the vectorized run")
+    ap.add_argument("--scalar-spreads", type=int, default=200_000, help="spreads for the scalar run")
+    ap.add_argument("--k", type=int, nargs="+", default=[3, 10], help="cards per spread")
+    ap.add_argument("--chunk", type=int, default=100_000,
+                    help="spreads per batch() call; memory grows ~1 KB per spread")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    print("p-values far below 0.001 on a big run mean the draw is biased; duplicates must be 0.")
+    bench_single(args.scalar_spreads)
+    for k in args.k:
+        bench_scalar(k, args.scalar_spreads)
+        bench_batch(k, args.spreads, args.chunk, args.seed)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# main.py требует токены при импорте — для бенчмарка хватит заглушек
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("PROVIDER_TOKEN", "bench")
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup  # noqa: E402
+
+QUESTION = "Що мене чекає в роботі протягом найближчого місяця?"
+
+
+# --- як було: текст з += на кожне ворожіння, клавіатура збирається заново ---
+def legacy_main_menu() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[
+        [KeyboardButton(text="🔮 Одна карта — порада долі")],
+        [KeyboardButton(text="🃏 Три карти — шлях душі")],
+        [KeyboardButton(text="✨ Кельтський хрест — повне ворожіння")],
+        [KeyboardButton(text="❓ Так / Ні — швидка відповідь")],
+        [KeyboardButton(text="🪐 Натальна карта")],
+        [KeyboardButton(text="💳 Купити ворожіння")],
+        [KeyboardButton(text="📜 Дисклеймер")],
+    ])
+
+
+def legacy_card(card):
+    emoji = "🌙" if card.reversed else "✨"
+    label = "(перевернута)" if card.reversed else "(пряма)"
+    return emoji, main.NAMES[card.code], label, main.MEANINGS[card.code][card.orient]
+
+
+def legacy_three(cards):
+    text = "*Три карти — шлях душі*\n\n"
+    positions = ["🕰 Минуле", "🌟 Теперішнє", "🔮 Майбутнє"]
+    for i, card in enumerate(cards):
+        emoji, name, label, meaning = legacy_card(card)
+        text += (
+            f"{positions[i]}\n"
+            f"{emoji} *{name}* {label}\n"
+            f"{meaning}\n\n"
+        )
+    return [text + "Три нитки сплелись… шлях уже змінюється ✨"]
+
+
+def legacy_celtic(cards):
+    text = (
+        "*✨ Кельтський хрест — повне ворожіння*\n"
+        f"*Запит:* _{main.md_escape(QUESTION)}_\n\n"
+    )
+    for i, card in enumerate(cards):
+        emoji, name, label, meaning = legacy_card(card)
+        text += (
+            f"{main.CELTIC_CROSS_POSITIONS[i]}\n"
+            f"{emoji} *{name}* {label}\n"
+            f"{meaning}\n\n"
+        )
+    text += "🧿 *Порада:* дивись на 1↔2 (конфлікт), 3↔5 (корінь↔намір), 7↔8 (ти↔оточення)."
+    chunk = 3500
+    parts = [text[i:i + chunk] for i in range(0, len(text), chunk)]
+    return parts, legacy_main_menu()
+
+
+# --- як зараз: готові фрагменти, пакування з одним join на повідомлення ---
+def current_three(cards):
+    blocks = [main.THREE_CARDS_HEADER, *main.spread_blocks("three", cards), main.THREE_CARDS_TRAILER]
+    return main.pack_blocks(blocks, first_limit=main.CAPTION_LIMIT)
+
+
+def current_celtic(cards):
+    blocks = [
+        main.CELTIC_CROSS_HEADER,
+        f"*Запит:* _{main.md_escape(QUESTION)}_\n\n",
+        *main.spread_blocks("celtic", cards),
+        main.CELTIC_CROSS_TRAILER,
+    ]
+    return main.pack_blocks(blocks, first_limit=main.CAPTION_LIMIT), main.MAIN_MENU_KB
+
+
+def bench(fn, spreads) -> float:
+    t0 = time.perf_counter()
+    for cards in spreads:
+        fn(cards)
+    return (time.perf_counter() - t0) / len(spreads) * 1e6
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Per-reading CPU cost of building reading text, before/after.")
+    ap.add_argument("--readings", type=int, default=50_000)
+    ap.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = ap.parse_args()
+
+    three = [main.draw_unique_cards(3) for _ in range(args.readings)]
+    celtic = [main.draw_unique_cards(10) for _ in range(args.readings)]
+
+    print(f"{'reading':<10} {'legacy us':>10} {'current us':>11} {'speedup':>8}")
+    for name, spreads, old, new in (
+        ("three", three, legacy_three, current_three),
+        ("celtic", celtic, legacy_celtic, current_celtic),
+    ):
+        t_old = min(bench(old, spreads) for _ in range(args.repeat))
+        t_new = min(bench(new, spreads) for _ in range(args.repeat))
+        print(f"{name:<10} {t_old:>10.2f} {t_new:>11.2f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+# Мінімальна заміна api.telegram.org для офлайн-прогонів: бот запускається з
+# TELEGRAM_API_BASE=http://127.0.0.1:8081, апдейти шле scripts/fake_updates.py.
+# Відповідає правдоподібними Message, видає file_id на аплоади й рахує
+# виклики та байти по методах.
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup", "sendInvoice"}
+
+
+class FakeBotApi:
+    def __init__(self, latency: float, flood_every: int):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.ids = itertools.count(1)
+        self.sends = 0
+        self.calls: dict[str, list[int]] = {}  # method -> [count, bytes]
+
+    def message(self, chat_id, **extra) -> dict:
+        msg = {
+            "message_id": next(self.ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+        }
+        msg.update(extra)
+        return msg
+
+    def photo(self, media: str) -> list[dict]:
+        # уже відомий file_id повертаємо як є, на аплоад (attach:// або файл) видаємо новий
+        file_id = media if media and not media.startswith(("attach://", "<upload")) else f"FAKE{next(self.ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        stat = self.calls.setdefault(method, [0, 0])
+        stat[0] += 1
+
+        if request.content_type.startswith("multipart"):
+            # аплоади йдуть chunked без content_length — рахуємо розмір полів самі
+            form = {}
+            for k, v in (await request.post()).items():
+                if isinstance(v, str):
+                    form[k] = v
+                    stat[1] += len(v.encode())
+                else:
+                    form[k] = f"<upload {v.filename}>"
+                    stat[1] += v.file.seek(0, 2)
+        elif request.content_type == "application/json":
+            stat[1] += len(await request.read())
+            form = await request.json()
+        else:
+            stat[1] += len(await request.read())
+            form = dict(await request.post()) if request.can_read_body else {}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in SEND_METHODS:
+            self.sends += 1
+            if self.flood_every and self.sends % self.flood_every == 0:
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }, status=429)
+
+        chat_id = form.get("chat_id", 1)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method == "getUpdates":
+            await asyncio.sleep(min(float(form.get("timeout", 0) or 0), 1.0))
+            result = []
+        elif method == "sendPhoto":
+            result = self.message(chat_id, photo=self.photo(form.get("photo", "")), caption=form.get("caption"))
+        elif method == "sendMediaGroup":
+            media = json.loads(form["media"]) if isinstance(form["media"], str) else form["media"]
+            result = [self.message(chat_id, photo=self.photo(m["media"])) for m in media]
+        elif method in SEND_METHODS:
+            result = self.message(chat_id, text=form.get("text") or form.get("title", ""))
+        else:
+            result = True  # sendChatAction, answerPreCheckoutQuery, setWebhook, ...
+        return web.json_response({"ok": True, "result": result})
+
+    def report(self) -> None:
+        print(f"{'method':<24} {'calls':>7} {'KB in':>10}")
+        for method, (count, size) in sorted(self.calls.items()):
+            print(f"{method:<24} {count:>7} {size / 1024:>10.1f}")
+
+
+async def run(args) -> None:
+    api = FakeBotApi(args.latency_ms / 1000, args.flood_every)
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"fake Bot API on http://{args.host}:{args.port} (Ctrl+C to stop and print totals)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        api.report()
+        await runner.cleanup()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0, help="added delay per call")
+    ap.add_argument("--flood-every", type=int, default=0, help="answer every Nth send with 429 retry_after=1")
+    args = ap.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
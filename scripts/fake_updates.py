@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import aiohttp
+
+# Локальна заміна Telegram для BOT_MODE=webhook: шлемо синтетичні апдейти на
+# вебхук бота з тим самим секретом, міряємо, як швидко він відповідає 200.
+# Відповіді самого бота підуть у справжній Bot API — для повністю офлайн-прогону
+# підніми поруч фейковий Bot API.
+DEFAULT_TEXTS = ["/start", "🔮 Одна карта — порада долі", "🃏 Три карти — шлях душі"]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "uk"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def post(session: aiohttp.ClientSession, url: str, secret: str | None, update: dict) -> tuple[int, float]:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    t0 = time.perf_counter()
+    async with session.post(url, json=update, headers=headers) as resp:
+        await resp.read()
+        return resp.status, time.perf_counter() - t0
+
+
+async def run(args) -> None:
+    texts = args.text or DEFAULT_TEXTS
+    sem = asyncio.Semaphore(args.concurrency)
+    results: list[tuple[int, float]] = []
+
+    async with aiohttp.ClientSession() as session:
+        if args.check_secret:
+            status, _ = await post(session, args.url, "wrong-secret", make_update(0, args.user_id, "/start"))
+            print(f"wrong secret -> HTTP {status} ({'ok' if status == 401 else 'EXPECTED 401'})")
+
+        async def one(i: int) -> None:
+            update = make_update(args.first_update_id + i, args.user_id + i % args.users, texts[i % len(texts)])
+            async with sem:
+                results.append(await post(session, args.url, args.secret, update))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - t0
+
+    codes: dict[int, int] = {}
+    for status, _ in results:
+        codes[status] = codes.get(status, 0) + 1
+    lat = sorted(dt * 1000 for _, dt in results)
+    p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+    print(f"updates : {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:,.0f}/s)")
+    print("status  : " + ", ".join(f"{code}x{n}" for code, n in sorted(codes.items())))
+    print(f"ack ms  : p50={statistics.median(lat):.1f} p95={p95:.1f} max={lat[-1]:.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="POST synthetic Telegram updates to the bot's webhook.")
+    ap.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    ap.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    ap.add_argument("--text", action="append", help="message text to send (repeatable, cycled)")
+    ap.add_argument("--count", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--user-id", type=int, default=100000)
+    ap.add_argument("--users", type=int, default=1, help="spread updates over this many user ids")
+    ap.add_argument("--first-update-id", type=int, default=1)
+    ap.add_argument("--check-secret", action="store_true", help="also verify that a wrong secret is rejected")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,163 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+
 from PIL import Image
 
+# Что собираем для каждой исходной карты cards/<stem>.jpg:
+#   cards/<stem>_rev.jpg            — перевёрнутая, полный размер
+#   cards/tg/<stem>.jpg, _rev.jpg   — пережатые под Telegram (не больше --target-kb)
+#   cards/thumbs/<stem>.jpg, _rev   — миниатюры
+# cards/.manifest.json хранит sha1 исходников и параметры сборки: пересобираем
+# только изменённые карты, а при других --target-kb/--tg-max-side/--thumb-side — все.
+EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+MANIFEST_NAME = ".manifest.json"
+MIN_SIDE = 64  # меньше не уменьшаем: такая карта уже нечитаема
+PIPELINE_VERSION = 1  # подними, если поменялись параметры сборки — пересоберётся всё
+
+
+def _sha1(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _save_jpeg(im: Image.Image, dst: Path, quality: int = 92) -> int:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    im.convert("RGB").save(dst, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return dst.stat().st_size
+
+
+def _save_under(im: Image.Image, dst: Path, max_side: int, target_bytes: int) -> int:
+    """Пережимаем, а если не хватает и самого низкого качества — уменьшаем,
+    пока файл не влезет в target_bytes. Не влез и в MIN_SIDE — ошибка карты."""
+    im = im.convert("RGB")
+    side = max_side
+    while True:
+        scaled = im.copy()
+        scaled.thumbnail((side, side), Image.LANCZOS)
+        for quality in (88, 82, 76, 70, 62, 55, 48, 40):
+            buf = io.BytesIO()
+            scaled.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+            data = buf.getvalue()
+            if len(data) <= target_bytes:
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                dst.write_bytes(data)
+                return len(data)
+        if side <= MIN_SIDE:
+            raise ValueError(f"{dst.name}: {len(data)} bytes at {side}px, target {target_bytes} bytes")
+        side = max(MIN_SIDE, int(side * 0.8))
+
+
+def outputs_for(src: Path) -> list[Path]:
+    ext = src.suffix.lower()
+    rev_name = f"{src.stem}_rev{ext}"
+    tg_dir, thumbs_dir = src.parent / "tg", src.parent / "thumbs"
+    return [
+        src.with_name(rev_name),
+        tg_dir / f"{src.stem}.jpg",
+        tg_dir / f"{src.stem}_rev.jpg",
+        thumbs_dir / f"{src.stem}.jpg",
+        thumbs_dir / f"{src.stem}_rev.jpg",
+    ]
+
+
+def build_card(src: str, tg_max_side: int, target_bytes: int, thumb_side: int) -> tuple[str, int]:
+    src_path = Path(src)
+    rev_full, tg_up, tg_rev, thumb_up, thumb_rev = outputs_for(src_path)
+    written = 0
+    with Image.open(src_path) as im:
+        im.load()
+        rev = im.rotate(180, expand=True)
+
+        # если JPEG, сохраняем с нормальным качеством
+        if rev_full.suffix.lower() in {".jpg", ".jpeg"}:
+            written += _save_jpeg(rev, rev_full)
+        else:
+            rev.save(rev_full)
+            written += rev_full.stat().st_size
+
+        written += _save_under(im, tg_up, tg_max_side, target_bytes)
+        written += _save_under(rev, tg_rev, tg_max_side, target_bytes)
+        written += _save_under(im, thumb_up, thumb_side, target_bytes)
+        written += _save_under(rev, thumb_rev, thumb_side, target_bytes)
+    return src, written
+
+
 def main():
-    cards_dir = Path("cards")  # <-- если у тебя папка с картами не ./cards, поменяй здесь
+    ap = argparse.ArgumentParser(description="Build reversed / Telegram-optimized card assets.")
+    ap.add_argument("--cards", default="cards", help="folder with source card images")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--target-kb", type=int, default=80, help="max size of each Telegram variant")
+    ap.add_argument("--tg-max-side", type=int, default=1280)
+    ap.add_argument("--thumb-side", type=int, default=160)
+    ap.add_argument("--force", action="store_true", help="rebuild everything, ignore manifest")
+    args = ap.parse_args()
+
+    cards_dir = Path(args.cards)
     if not cards_dir.exists():
         raise SystemExit(f"Folder not found: {cards_dir.resolve()}")
 
-    exts = {".jpg", ".jpeg", ".png", ".webp"}
-    src_files = [
+    src_files = sorted(
         p for p in cards_dir.iterdir()
         if p.is_file()
-        and p.suffix.lower() in exts
+        and p.suffix.lower() in EXTS
         and not p.stem.lower().endswith("_rev")
-    ]
+    )
 
-    made = 0
-    for src in src_files:
-        dst = src.with_name(f"{src.stem}_rev{src.suffix.lower()}")
+    manifest_path = cards_dir / MANIFEST_NAME
+    params = {"target_kb": args.target_kb, "tg_max_side": args.tg_max_side, "thumb_side": args.thumb_side}
+    manifest = {}
+    if manifest_path.exists() and not args.force:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if manifest.get("version") != PIPELINE_VERSION or manifest.get("params") != params:
+        manifest = {"version": PIPELINE_VERSION, "params": params, "cards": {}}
+    known = manifest["cards"]
 
-        # не перезаписываем, если уже есть
-        if dst.exists():
-            continue
-
-        with Image.open(src) as im:
-            im = im.rotate(180, expand=True)
+    hashes = {}
+    todo = []
+    for src in src_files:
+        hashes[src.name] = digest = _sha1(src)
+        up_to_date = known.get(src.name) == digest and all(p.exists() for p in outputs_for(src))
+        if not up_to_date:
+            todo.append(src)
 
-            # если JPEG, сохраняем с нормальным качеством
-            if dst.suffix.lower() in {".jpg", ".jpeg"}:
-                im.save(dst, quality=92, optimize=True, progressive=True)
-            else:
-                im.save(dst)
+    total_bytes = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(build_card, str(src), args.tg_max_side, args.target_kb * 1024, args.thumb_side): src
+            for src in todo
+        }
+        for fut in as_completed(futures):
+            src = futures[fut]
+            try:
+                _, written = fut.result()
+            except Exception as e:
+                # одна битая карта не должна выбрасывать уже собранные остальные
+                failed.append((src.name, e))
+                known.pop(src.name, None)
+                continue
+            total_bytes += written
+            known[src.name] = hashes[src.name]
 
-        made += 1
+    # забываем удалённые исходники
+    for name in list(known):
+        if name not in hashes:
+            del known[name]
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
 
     print(f"Source files: {len(src_files)}")
-    print(f"Created rev : {made}")
+    print(f"Rebuilt     : {len(todo) - len(failed)}")
+    print(f"Up to date  : {len(src_files) - len(todo)}")
+    print(f"Written     : {total_bytes / 1024 / 1024:.1f} MB")
+    if failed:
+        print(f"Failed      : {len(failed)}")
+        for name, e in sorted(failed):
+            print(f"  {name}: {e!r}")
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
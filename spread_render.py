@@ -0,0 +1,71 @@
+import io
+import os
+
+from PIL import Image
+
+# Рендер зведеної картинки розкладу. Окремий модуль, бо його імпортують
+# процеси-рендерери (spawn): тут лише Pillow, без aiogram і без бота з main.py.
+SPREAD_TILE_W, SPREAD_TILE_H = 200, 343
+SPREAD_GAP = 16
+SPREAD_BG = (18, 14, 30)
+
+# позиції карт у клітинках (col, row); для "celtic" друга карта лежить поперек першої
+SPREAD_LAYOUTS = {
+    "three": [(0, 0), (1, 0), (2, 0)],
+    "celtic": [
+        (1, 1.5),  # 1 серце питання
+        (1, 1.5),  # 2 перехрестя (повернута на 90°)
+        (1, 2.5),  # 3 корінь
+        (0, 1.5),  # 4 минуле
+        (1, 0.5),  # 5 свідоме
+        (2, 1.5),  # 6 найближче майбутнє
+        (3.5, 3),  # 7 ти в ситуації (посох знизу вгору)
+        (3.5, 2),  # 8 оточення
+        (3.5, 1),  # 9 надії та страхи
+        (3.5, 0),  # 10 підсумок
+    ],
+}
+
+_tiles: dict[tuple[str, bool], Image.Image] = {}  # кеш плиток усередині процесу-воркера
+
+
+def warm() -> int:
+    """Порожнє завдання для старту пулу: процес піднявся, плагіни Pillow завантажені."""
+    Image.init()
+    return os.getpid()
+
+
+def spread_tile(path: str, rotate: bool) -> Image.Image:
+    tile = _tiles.get((path, rotate))
+    if tile is None:
+        with Image.open(path) as im:
+            tile = im.convert("RGB").resize((SPREAD_TILE_W, SPREAD_TILE_H), Image.LANCZOS)
+        if rotate:
+            tile = tile.rotate(180)
+        _tiles[(path, rotate)] = tile
+    return tile
+
+
+def render_spread_sync(layout: str, cards: tuple[tuple[str, bool], ...]) -> bytes:
+    """cards — (файл карти, повернути на 180°?) у порядку позицій розкладу."""
+    slots = SPREAD_LAYOUTS[layout]
+    cols = max(c for c, _ in slots) + 1
+    rows = max(r for _, r in slots) + 1
+    step_x, step_y = SPREAD_TILE_W + SPREAD_GAP, SPREAD_TILE_H + SPREAD_GAP
+    canvas = Image.new(
+        "RGB",
+        (int(cols * step_x + SPREAD_GAP), int(rows * step_y + SPREAD_GAP)),
+        SPREAD_BG,
+    )
+    for i, ((path, rotate), (col, row)) in enumerate(zip(cards, slots)):
+        tile = spread_tile(path, rotate)
+        x = int(SPREAD_GAP + col * step_x)
+        y = int(SPREAD_GAP + row * step_y)
+        if layout == "celtic" and i == 1:
+            tile = tile.rotate(90, expand=True)
+            x += (SPREAD_TILE_W - tile.width) // 2
+            y += (SPREAD_TILE_H - tile.height) // 2
+        canvas.paste(tile, (x, y))
+    out = io.BytesIO()
+    canvas.save(out, format="JPEG", quality=85, optimize=True)
+    return out.getvalue()
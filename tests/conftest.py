@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# main.py вимагає токени при імпорті й шукає cards/ відносно cwd
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("PROVIDER_TOKEN", "test")
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def state_paths(tmp_path, monkeypatch):
+    """Усі файли стану — у tmp_path, щоб тести не чіпали робочі users_state.*."""
+    state = tmp_path / "users_state.json"
+    monkeypatch.setattr(main, "STATE_PATH", state)
+    monkeypatch.setattr(main, "STATE_LOG_PATH", state.with_suffix(".log"))
+    monkeypatch.setattr(main, "STATE_LOG_OLD_PATH", state.with_suffix(".log.old"))
+    monkeypatch.setattr(main, "STATE_DB_PATH", tmp_path / "users_state.sqlite3")
+    return tmp_path
@@ -0,0 +1,51 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import BufferedInputFile
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import main
+from scripts.fake_bot_api import FakeBotApi
+
+
+def test_api_counters_match_fake_server(monkeypatch):
+    monkeypatch.setattr(main.random, "uniform", lambda a, b: 0.0)
+    photo = bytes(range(256)) * 200  # 50 KB аплоаду
+
+    async def run():
+        api = FakeBotApi(latency=0, flood_every=2)  # друга відправка отримає 429 retry_after=1
+        app = web.Application(client_max_size=8 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", api.handle)
+        server = TestServer(app)
+        await server.start_server()
+        base = str(server.make_url("")).rstrip("/")
+        bot = Bot("123456:test", session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+        metrics = main.ApiCallMetrics()
+        # той самий порядок, що в бота: планувальник, потім метрики ближче до мережі
+        bot.session.middleware(main.OutboundScheduler(1000, 10, 1000, 30, max_retries=3))
+        bot.session.middleware(metrics)
+        try:
+            sent = await bot.send_photo(1, BufferedInputFile(photo, filename="card.jpg"))
+            await bot.send_message(1, "привіт")
+        finally:
+            await bot.session.close()
+            await server.close()
+        return api, metrics, sent
+
+    api, metrics, sent = asyncio.run(run())
+    assert sent.photo[-1].file_id.startswith("FAKE")
+
+    up = metrics.methods["sendPhoto"]
+    server_calls, server_bytes = api.calls["sendPhoto"]
+    assert server_calls == 1 and up.retry_after == 0 and up.errors == 0
+    assert len(photo) <= up.bytes <= server_bytes + 64  # файл + кілька коротких полів
+
+    msg = metrics.methods["sendMessage"]
+    assert api.calls["sendMessage"][0] == 2  # 429 і повтор
+    assert msg.retry_after == 1 and msg.errors == 0
+    # дві спроби; Default-заглушки (parse_mode тощо) не рахуються
+    assert 2 * len("привіт".encode()) <= msg.bytes <= api.calls["sendMessage"][1]
+    assert main.API_SECONDS.series["sendMessage"].count >= 2
@@ -0,0 +1,105 @@
+import asyncio
+
+import main
+
+
+def test_key_sync_matches_rendered_image_without_rendering():
+    async def run():
+        store = main.CardImageStore(main.CARD_REV_CACHE_BYTES)
+        await store.load()
+        names = store.names()[:3]
+        keys = {(name, rev): store.key_sync(name, rev) for name in names for rev in (False, True)}
+        assert store.rev_renders == 0
+        for (name, rev), key in keys.items():
+            assert key == (await store.get(name, reversed_=rev)).key
+        assert store.key_sync("missing.jpg", True) is None
+
+    asyncio.run(run())
+
+
+def test_spread_pool_size_is_split_between_workers(monkeypatch):
+    monkeypatch.setattr(main, "SPREAD_RENDER_WORKERS", 4)
+    monkeypatch.setattr(main, "WORKERS", 1)
+    assert main.spread_pool_size() == 4
+    monkeypatch.setattr(main, "WORKERS", 3)
+    assert main.spread_pool_size() == 2
+    monkeypatch.setattr(main, "WORKERS", 8)
+    assert main.spread_pool_size() == 1
+
+
+def test_render_spread_sync_draws_every_layout():
+    import io
+
+    from PIL import Image
+
+    import spread_render
+
+    path = main.os.path.join(main.CARDS_FOLDER, main.DECK[0].image)
+    for layout, slots in spread_render.SPREAD_LAYOUTS.items():
+        data = spread_render.render_spread_sync(layout, tuple((path, i % 2 == 1) for i in range(len(slots))))
+        with Image.open(io.BytesIO(data)) as im:
+            assert im.format == "JPEG" and im.width > spread_render.SPREAD_TILE_W
+
+
+def test_store_reads_the_file_chosen_by_card_entry(tmp_path, monkeypatch):
+    import shutil
+
+    card = main.DECK[0]
+    name, src = card.image, main.os.path.join(main.CARDS_FOLDER, card.image)
+    shutil.copy(src, tmp_path / name)
+    monkeypatch.setattr(main, "CARDS_FOLDER", str(tmp_path))
+
+    up = main.CardEntry(0, card.code, "up")
+    rev = main.CardEntry(1, card.code, "rev")
+    assert (up.path, up.rotate) == (str(tmp_path / name), False)
+    assert (rev.path, rev.rotate) == (up.path, True)  # без готового _rev — поворот прямої
+
+    # з'явились пережаті tg-варіанти: і пряма, і перевернута беруться звідти
+    (tmp_path / "tg").mkdir()
+    shutil.copy(src, tmp_path / "tg" / name)
+    shutil.copy(src, tmp_path / "tg" / main._rev_name(name))
+    up = main.CardEntry(0, card.code, "up")
+    rev = main.CardEntry(1, card.code, "rev")
+    assert (up.path, rev.path, rev.rotate) == (
+        str(tmp_path / "tg" / name), str(tmp_path / "tg" / main._rev_name(name)), False,
+    )
+    monkeypatch.setattr(main, "DECK", (up, rev))
+
+    async def run():
+        store = main.CardImageStore(main.CARD_REV_CACHE_BYTES)
+        await store.load()
+        assert store.names() == [name]
+        assert (await store.get(name)).key.startswith(up.path + ":")
+        assert (await store.get(name, reversed_=True)).key.startswith(rev.path + ":")
+        assert store.rev_renders == 1 and store.key_sync(name, True) == (await store.get(name, True)).key
+
+    asyncio.run(run())
+
+
+def test_preupload_waits_only_until_ritual_deadline(monkeypatch):
+    monkeypatch.setattr(main, "STORAGE_CHAT_ID", -100)
+    monkeypatch.setattr(main, "RITUAL_SECONDS", 0.2)
+    monkeypatch.setattr(main, "_preupload_inflight", {})
+
+    async def slow_preupload(img):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(main, "_preupload", slow_preupload)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        deadline = main.ritual_deadline()
+        await asyncio.sleep(0.15)  # карти й картинка зібрались не миттєво
+        await main.preupload_images([main.CardImage("a.jpg", "k:a", b"")], deadline)
+        waited = loop.time() - t0
+        # дедлайн уже минув — не чекаємо взагалі, заливка триває у фоні
+        await main.preupload_images([main.CardImage("b.jpg", "k:b", b"")], deadline)
+        late = loop.time() - t0 - waited
+        for task in main._preupload_inflight.values():
+            task.cancel()
+        return waited, late
+
+    waited, late = asyncio.run(run())
+    assert 0.19 <= waited < 0.3
+    assert late < 0.05
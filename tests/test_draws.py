@@ -0,0 +1,45 @@
+import pytest
+
+import main
+from main import DrawEngine
+
+
+@pytest.mark.parametrize("k", [1, 3, 10, len(main.ALL_CODES)])
+def test_draw_never_repeats_a_card(k):
+    engine = DrawEngine.seeded(1234)
+    for _ in range(500):
+        cards = engine.draw(k)
+        assert len(cards) == k
+        assert len({card.code for card in cards}) == k
+        assert all(main.DECK[card.index] is card for card in cards)
+
+
+def test_same_seed_same_spreads():
+    a, b = DrawEngine.seeded(7), DrawEngine.seeded(7)
+    assert [[c.index for c in a.draw(10)] for _ in range(50)] == [[c.index for c in b.draw(10)] for _ in range(50)]
+
+
+def test_draw_rejects_impossible_k():
+    engine = DrawEngine.seeded(0)
+    assert engine.draw(0) == []
+    with pytest.raises(ValueError):
+        engine.draw(len(main.ALL_CODES) + 1)
+
+
+def test_draw_covers_both_orientations():
+    engine = DrawEngine.seeded(99)
+    seen = {card.orient for _ in range(200) for card in engine.draw(3)}
+    assert seen == set(main.ORIENTS)
+
+
+def test_batch_rows_are_unique_and_reproducible():
+    np = pytest.importorskip("numpy")
+    engine = DrawEngine.seeded(0)
+    codes, orients = engine.batch(2000, 10, seed=5)
+    assert codes.shape == orients.shape == (2000, 10)
+    s = np.sort(codes, axis=1)
+    assert not np.any(s[:, 1:] == s[:, :-1])
+    assert codes.min() >= 0 and codes.max() < len(main.ALL_CODES)
+    assert set(np.unique(orients)) <= {0, 1}
+    again, _ = engine.batch(2000, 10, seed=5)
+    assert np.array_equal(codes, again)
@@ -0,0 +1,52 @@
+import pytest
+
+import main
+from main import CAPTION_LIMIT, TEXT_LIMIT, pack_blocks, tg_len
+
+
+def test_tg_len_counts_utf16_code_units():
+    assert tg_len("abc") == 3
+    assert tg_len("🔮") == 2  # поза BMP — сурогатна пара
+    assert tg_len("Ї") == 1
+
+
+def _check(parts, blocks, first_limit, limit):
+    assert tg_len(parts[0]) <= first_limit
+    assert all(tg_len(part) <= limit for part in parts[1:])
+    assert all(parts[1:])  # порожньою буває лише перша частина
+    # блоки не губляться й не переставляються
+    text = "".join(parts)
+    pos = 0
+    for block in blocks:
+        pos = text.index(block.strip(), pos)
+
+
+@pytest.mark.parametrize("layout,n", [("three", 3), ("celtic", 10)])
+def test_real_spreads_respect_limits(layout, n):
+    header = main.THREE_CARDS_HEADER if layout == "three" else main.CELTIC_CROSS_HEADER
+    trailer = main.THREE_CARDS_TRAILER if layout == "three" else main.CELTIC_CROSS_TRAILER
+    engine = main.DrawEngine.seeded(3)
+    for _ in range(200):
+        blocks = [header, *main.spread_blocks(layout, engine.draw(n)), trailer]
+        for first_limit in (CAPTION_LIMIT, TEXT_LIMIT, 0):
+            _check(pack_blocks(blocks, first_limit=first_limit), blocks, first_limit, TEXT_LIMIT)
+
+
+def test_packs_greedily_into_fewest_parts():
+    blocks = ["a" * 40 + "\n", "b" * 40 + "\n", "c" * 40 + "\n"]
+    assert pack_blocks(blocks, first_limit=100, limit=100) == ["a" * 40 + "\n" + "b" * 40, "c" * 40]
+    assert len(pack_blocks(blocks, first_limit=200, limit=200)) == 1
+
+
+def test_first_part_empty_when_first_block_does_not_fit():
+    parts = pack_blocks(["x" * 50], first_limit=10, limit=100)
+    assert parts == ["", "x" * 50]
+
+
+def test_oversized_block_is_split_between_lines():
+    line = "*жирний рядок*\n"
+    block = line * 100
+    parts = pack_blocks(["header\n", block], first_limit=100, limit=200)
+    assert all(tg_len(part) <= 200 for part in parts)
+    assert all(part.count("*") % 2 == 0 for part in parts)  # розмітка не розірвана
+    assert "".join(parts).count("жирний") == 100
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerPreCheckoutQuery, SendMessage
+
+import main
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = main.TokenBucket(rate=10, burst=3)
+    bucket.tokens = 0.0
+    bucket.updated -= 0.15
+    bucket._refill()
+    assert bucket.tokens == pytest.approx(1.5, abs=0.05)
+
+    bucket.updated -= 10
+    bucket._refill()
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_penalty_waits_exactly_retry_after():
+    bucket = main.TokenBucket(rate=2, burst=3)
+    bucket.penalize(1.0)
+    # acquire() спить (1 - tokens) / rate — це й має бути retry_after
+    assert (1 - bucket.tokens) / bucket.rate == pytest.approx(1.0, abs=0.01)
+
+    async def run():
+        bucket = main.TokenBucket(rate=20, burst=1)
+        bucket.penalize(0.2)
+        t0 = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - t0
+
+    assert 0.19 <= asyncio.run(run()) < 0.3
+
+
+def test_priority_bucket_serves_payments_first():
+    async def run():
+        bucket = main.PriorityTokenBucket(rate=50, burst=1)
+        await bucket.acquire()  # відро порожнє, далі всі стають у чергу
+        order = []
+
+        async def send(tag, priority):
+            await bucket.acquire(priority)
+            order.append(tag)
+
+        await asyncio.gather(
+            send("a", main.PRIORITY_NORMAL),
+            send("b", main.PRIORITY_NORMAL),
+            send("pay", main.PRIORITY_PAYMENT),
+        )
+        return order
+
+    assert asyncio.run(run()) == ["pay", "a", "b"]
+
+
+def _retry_once(retry_after: int):
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+        return True
+
+    return make_request, calls
+
+
+@pytest.mark.parametrize(
+    "method",
+    [
+        SendMessage(chat_id=1, text="hi"),  # чекає відро чату
+        AnswerPreCheckoutQuery(pre_checkout_query_id="q", ok=True),  # без чату — sleep
+    ],
+)
+def test_scheduler_retry_waits_once(method, monkeypatch):
+    monkeypatch.setattr(main.random, "uniform", lambda a, b: 0.0)
+    scheduler = main.OutboundScheduler(1, 3, 30, 30, max_retries=3)
+    make_request, calls = _retry_once(1)
+
+    assert asyncio.run(scheduler(make_request, main.bot, method)) is True
+    assert len(calls) == 2
+    assert 0.95 <= calls[1] - calls[0] < 1.3  # не retry_after + ще раз штраф відра
+    stats = scheduler.stats()
+    assert stats["retry_after"] == 1 and stats["retry_after_sum"] == 1 and stats["gave_up"] == 0
+
+
+def test_scheduler_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(main.random, "uniform", lambda a, b: 0.0)
+    scheduler = main.OutboundScheduler(1000, 3, 1000, 30, max_retries=0)
+
+    async def make_request(bot, method):
+        raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=5)
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scheduler(make_request, main.bot, SendMessage(chat_id=1, text="hi")))
+    assert scheduler.stats()["gave_up"] == 1
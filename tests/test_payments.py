@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+from aiogram import types
+
+import main
+
+
+@pytest.fixture
+def ledger(state_paths, monkeypatch):
+    """Журнал платежів і стан — у tmp_path, індекс charge id — порожній."""
+    path = state_paths / "payments.log"
+    monkeypatch.setattr(main, "PAYMENT_LEDGER_PATH", path)
+    monkeypatch.setattr(main, "_payment_charges", {})
+    monkeypatch.setattr(main, "_store", main.JsonStateBackend())
+    return path
+
+
+def _payment(charge: str, payload: str = "pack_5") -> types.SuccessfulPayment:
+    return types.SuccessfulPayment(
+        currency=main.CURRENCY,
+        total_amount=main.PACKS[payload]["amount"],
+        invoice_payload=payload,
+        telegram_payment_charge_id=charge,
+        provider_payment_charge_id=f"p-{charge}",
+    )
+
+
+def _query(payload: str, amount: int, currency: str | None = None) -> types.PreCheckoutQuery:
+    return types.PreCheckoutQuery(
+        id="q1",
+        from_user=types.User(id=1, is_bot=False, first_name="Test"),
+        currency=currency or main.CURRENCY,
+        total_amount=amount,
+        invoice_payload=payload,
+    )
+
+
+def _lines(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_duplicate_charge_is_recorded_once(ledger):
+    async def run():
+        await main.load_state()
+        await main.load_payment_ledger()
+        assert await main.record_payment(1, _payment("c1"))
+        assert not await main.record_payment(1, _payment("c1"))
+        # після рестарту дубль відсікається з журналу
+        await main.load_payment_ledger()
+        assert not await main.record_payment(1, _payment("c1"))
+
+    asyncio.run(run())
+    assert [e["charge"] for e in _lines(ledger)] == ["c1"]
+
+
+def test_apply_marks_payment_after_credits_are_durable(ledger):
+    async def run():
+        await main.load_state()
+        await main.load_payment_ledger()
+        await main.record_payment(1, _payment("c1"))
+        await main.apply_payment(main._payment_charges["c1"])
+        await main.load_payment_ledger()
+        assert main._payment_charges["c1"]["applied"]
+        assert await main.reconcile_payments() == 0
+
+    asyncio.run(run())
+    state = json.loads(main.STATE_PATH.read_text(encoding="utf-8"))
+    assert state["1"]["credits"] == 5
+    assert _lines(ledger)[-1]["applied"] == "c1"
+
+
+def test_reconcile_reapplies_payment_lost_before_credits(ledger):
+    async def run():
+        await main.load_state()
+        await main.load_payment_ledger()
+        await main.record_payment(1, _payment("c1", "pack_10_natal"))
+        # краш до нарахування: у журналі є платіж, applied немає
+
+        main._store = main.JsonStateBackend()
+        await main.load_state()
+        await main.load_payment_ledger()
+        assert await main.reconcile_payments() == 1
+        st = await main.get_user_state(1)
+        assert st.credits == main.PACKS["pack_10_natal"]["credits"]
+        assert st.natal
+        # друга звірка нічого не додає
+        await main.load_payment_ledger()
+        assert await main.reconcile_payments() == 0
+
+    asyncio.run(run())
+
+
+def test_torn_tail_is_truncated_only_by_writer(ledger):
+    async def run():
+        await main.load_state()
+        await main.load_payment_ledger()
+        await main.record_payment(1, _payment("c1"))
+
+    asyncio.run(run())
+    whole = ledger.read_bytes()
+    ledger.write_bytes(whole + b'{"charge":"c2","us')
+
+    assert set(main._load_ledger_sync(writer=False)) == {"c1"}
+    assert ledger.read_bytes() == whole + b'{"charge":"c2","us'  # воркер не обрізає
+
+    assert set(main._load_ledger_sync(writer=True)) == {"c1"}
+    assert ledger.read_bytes() == whole
+
+
+def test_append_after_torn_tail_keeps_new_entry(ledger):
+    ledger.write_bytes(b'{"charge":"c0","us')  # чужий краш посеред append
+    main._ledger_append_sync({"charge": "c1", "user": 1, "credits": 5, "natal": False})
+    assert set(main._load_ledger_sync(writer=False)) == {"c1"}
+
+
+@pytest.mark.parametrize(
+    ("payload", "amount", "currency", "ok"),
+    [
+        ("pack_5", main.PACKS["pack_5"]["amount"], None, True),
+        ("pack_5", main.PACKS["pack_5"]["amount"] - 1, None, False),
+        ("pack_5", main.PACKS["pack_5"]["amount"], "XTR", False),
+        ("pack_gone", 100, None, False),
+    ],
+)
+def test_check_pre_checkout(payload, amount, currency, ok):
+    assert (main.check_pre_checkout(_query(payload, amount, currency)) is None) is ok
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def _on_disk() -> dict:
+    return json.loads(main.STATE_PATH.read_text(encoding="utf-8"))
+
+
+def test_incomplete_backend_fails_on_construction():
+    class NoReset(main.StateBackend):
+        async def get(self, user_id):
+            return main.UserRecord()
+
+    with pytest.raises(TypeError):
+        NoReset()
+
+    assert "_write" in main.BufferedStateBackend.__abstractmethods__
+
+
+def test_sync_waits_for_group_commit(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_FLUSH_WINDOW", 0.05)
+
+    async def run():
+        store = main.JsonStateBackend()
+        await store.load()
+        await store.start()
+        await store.add_credits(1, 5)
+        await store.set_pending(2, "celtic_cross")
+        assert not main.STATE_PATH.exists()  # ще у вікні group commit
+        await store.sync()
+        data = _on_disk()
+        assert data["1"]["credits"] == 5
+        assert data["2"]["pending"]["kind"] == "celtic_cross"
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_sync_without_flusher_writes_itself(state_paths):
+    async def run():
+        store = main.JsonStateBackend()
+        await store.load()
+        await store.add_credits(7, 1)
+        await store.sync()
+        assert _on_disk()["7"]["credits"] == 1
+
+    asyncio.run(run())
+
+
+def test_close_flushes_buffer_without_waiting_window(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_FLUSH_WINDOW", 30)
+
+    async def run():
+        store = main.JsonStateBackend()
+        await store.load()
+        await store.start()
+        await store.consume_reading(3)
+        t0 = time.perf_counter()
+        await store.close()
+        assert time.perf_counter() - t0 < 5
+        assert _on_disk()["3"]["free_used"] == 1
+
+    asyncio.run(run())
+
+
+def test_close_does_not_overlap_inflight_write(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_FLUSH_WINDOW", 0)
+    real_save = main._save_state_sync
+    started = threading.Event()
+    active = 0
+    overlap = []
+    guard = threading.Lock()
+
+    def slow_save(state):
+        nonlocal active
+        with guard:
+            active += 1
+            overlap.append(active)
+        started.set()
+        time.sleep(0.2)
+        real_save(state)
+        with guard:
+            active -= 1
+
+    monkeypatch.setattr(main, "_save_state_sync", slow_save)
+
+    async def run():
+        store = main.JsonStateBackend()
+        await store.load()
+        await store.start()
+        await store.add_credits(1, 1)
+        await asyncio.to_thread(started.wait, 5)  # флашер уже пише
+        await store.add_credits(1, 1)
+        await store.close()
+
+    asyncio.run(run())
+    assert max(overlap) == 1
+    assert _on_disk()["1"]["credits"] == 2
+
+
+def _backends():
+    return {
+        "sqlite": main.SQLiteStateBackend(main.STATE_DB_PATH),
+        "cached": main.CachedStateBackend(main.SQLiteStateBackend(main.STATE_PATH.with_suffix(".cached.sqlite3")), 3),
+    }
+
+
+def test_sqlite_and_cached_backends_agree(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_FLUSH_WINDOW", 0.01)
+    ops = [
+        ("add_credits", 1, 2, False), ("consume_reading", 1), ("consume_reading", 2),
+        ("set_pending", 3, "celtic_cross"), ("add_credits", 4, 10, True), ("consume_reading", 5),
+        ("consume_reading", 5), ("consume_reading", 5), ("consume_reading", 5),  # free кінчились
+        ("reset", 4), ("set_pending", 3, None), ("add_credits", 6, 1, False), ("consume_reading", 1),
+        ("set_pending", 1, "celtic_cross"), ("consume_reading", 1),
+    ]
+
+    async def run(store):
+        await store.load()
+        await store.start()
+        results = [await getattr(store, op)(*args) for op, *args in ops]
+        await store.sync()
+        snapshot = {uid: (await store.get(uid)).to_json() for uid in range(1, 7)}
+        pending = await store.pending_users()
+        await store.close()
+        return [r.to_json() if isinstance(r, main.UserRecord) else r for r in results], snapshot, pending
+
+    out = {name: asyncio.run(run(store)) for name, store in _backends().items()}
+    for rec in (*out["sqlite"][1].values(), *out["cached"][1].values()):
+        if rec["pending"]:
+            rec["pending"]["ts"] = 0  # час постановки відрізняється між прогонами
+    assert out["sqlite"] == out["cached"]
+    assert out["sqlite"][2] == {1: "celtic_cross"}
+
+    async def reopen():
+        # кеш справді записав усе в inner
+        inner = main.SQLiteStateBackend(main.STATE_PATH.with_suffix(".cached.sqlite3"))
+        await inner.load()
+        rows = {uid: (await inner.get(uid)).credits for uid in range(1, 7)}
+        await inner.close()
+        return rows
+
+    assert asyncio.run(reopen()) == {uid: rec["credits"] for uid, rec in out["sqlite"][1].items()}
+
+
+def test_cached_eviction_keeps_inflight_write_back(state_paths):
+    async def run():
+        store = main.CachedStateBackend(main.SQLiteStateBackend(main.STATE_DB_PATH), 1)
+        await store.load()
+        real_put_many = store.inner.put_many
+        writing = asyncio.Event()
+
+        async def slow_put_many(records):
+            writing.set()
+            await asyncio.sleep(0.2)
+            await real_put_many(records)
+
+        store.inner.put_many = slow_put_many
+        await store.add_credits(1, 5)
+        flush = asyncio.create_task(store._flush())
+        await writing.wait()
+        evict = asyncio.create_task(store.get(2))  # витісняє юзера 1, поки той пишеться
+        await asyncio.sleep(0.01)
+        assert (await store.get(1)).credits == 5
+        await asyncio.gather(flush, evict)
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_cached_reloaded_record_leaves_evicting(state_paths):
+    async def run():
+        store = main.CachedStateBackend(main.SQLiteStateBackend(main.STATE_DB_PATH), 1)
+        await store.load()
+        real_put_many = store.inner.put_many
+        writing = asyncio.Event()
+
+        async def slow_put_many(records):
+            writing.set()
+            await asyncio.sleep(0.2)
+            await real_put_many(records)
+
+        store.inner.put_many = slow_put_many
+        await store.add_credits(1, 5)
+        evict = asyncio.create_task(store.get(2))  # витісняє брудного юзера 1
+        await writing.wait()
+        await store.add_credits(1, 10)  # юзер 1 повертається в кеш посеред write-back
+        await evict
+        await store._flush()
+        await store.get(3)  # чисте витіснення юзера 1
+        assert not store._evicting
+        assert (await store.get(1)).credits == 15
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_cached_failed_eviction_keeps_record_in_cache(state_paths):
+    async def run():
+        store = main.CachedStateBackend(main.SQLiteStateBackend(main.STATE_DB_PATH), 1)
+        await store.load()
+        real_put_many = store.inner.put_many
+        fail = True
+
+        async def flaky_put_many(records):
+            if fail:
+                raise OSError("disk full")
+            await real_put_many(records)
+
+        store.inner.put_many = flaky_put_many
+        await store.add_credits(1, 5)
+        await store.get(2)  # write-back падає, але читання не ламається
+        assert not store._evicting
+        assert (await store.get(1)).credits == 5
+        fail = False
+        await store.sync()
+        await store.close()
+
+        inner = main.SQLiteStateBackend(main.STATE_DB_PATH)
+        await inner.load()
+        assert (await inner.get(1)).credits == 5
+        await inner.close()
+
+    asyncio.run(run())
+
+
+def test_sqlite_counts_every_write_as_a_save(state_paths, monkeypatch):
+    io = main.StateIoStats()
+    monkeypatch.setattr(main, "state_io", io)
+
+    async def run():
+        store = main.SQLiteStateBackend(main.STATE_DB_PATH)
+        await store.load()
+        await store.add_credits(1, 2)
+        await store.set_pending(1, "celtic_cross")
+        assert await store.consume_reading(1)
+        await store.get(1)  # читання — не збереження
+        await store.pending_users()
+        await store.put_many([(2, main.UserRecord(credits=1)), (3, main.UserRecord())])
+        await store.close()
+
+    asyncio.run(run())
+    assert io.saves == {"sqlite": 4}
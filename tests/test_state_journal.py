@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import main
+from main import UserRecord
+
+
+def test_user_record_json_round_trip():
+    rec = UserRecord(free_used=2, credits=7).with_credits(3, natal=True).with_pending("celtic_cross")
+    back = UserRecord.from_json(json.loads(json.dumps(rec.to_json())))
+    assert (back.free_used, back.credits, back.natal, back.pending_kind) == (2, 10, True, "celtic_cross")
+    assert back.pending_ts == rec.pending_ts
+    assert back.to_json() == rec.to_json()
+
+
+def test_user_record_from_json_ignores_unknown_pending():
+    rec = UserRecord.from_json({"credits": 1, "pending": {"kind": "nope", "ts": 5}})
+    assert rec.pending_kind is None and rec.pending_ts == 0
+    assert UserRecord.from_json({}).to_json() == UserRecord().to_json()
+
+
+def test_journal_replay_last_record_wins(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_JOURNAL", True)
+    main._journal_append_sync([(1, UserRecord(credits=1)), (2, UserRecord(free_used=1))])
+    main._journal_append_sync([(1, UserRecord(credits=5))])
+
+    state = main._load_state_sync()
+    assert state[1].credits == 5
+    assert state[2].free_used == 1
+
+
+def test_journal_replay_applies_old_log_before_current(state_paths, monkeypatch):
+    monkeypatch.setattr(main, "STATE_JOURNAL", True)
+    main._save_state_sync({1: UserRecord(credits=1)})
+    main._journal_append_sync([(1, UserRecord(credits=2))])
+    main.STATE_LOG_PATH.replace(main.STATE_LOG_OLD_PATH)  # компакція перервалась після ротації
+    main._journal_append_sync([(1, UserRecord(credits=3))])
+
+    assert main._load_state_sync()[1].credits == 3
+
+
+@pytest.mark.parametrize("tail", [b'{"u": "3", "s": {"cred', b"not json at all"])
+def test_journal_torn_tail_is_truncated(state_paths, tail):
+    log = main.STATE_LOG_PATH
+    main._journal_append_sync([(1, UserRecord(credits=4))])
+    good = log.stat().st_size
+    with open(log, "ab") as f:
+        f.write(tail)
+
+    state: dict[int, UserRecord] = {}
+    main._replay_journal_sync(state, log)
+    assert list(state) == [1] and state[1].credits == 4
+    assert log.stat().st_size == good
+
+    # нові записи після обрізки не склеюються з мусором
+    main._journal_append_sync([(2, UserRecord(credits=1))])
+    state = {}
+    main._replay_journal_sync(state, log)
+    assert state[2].credits == 1
+
+
+def test_journal_corrupt_middle_line_is_skipped(state_paths):
+    log = main.STATE_LOG_PATH
+    main._journal_append_sync([(1, UserRecord(credits=4))])
+    with open(log, "ab") as f:
+        f.write(b"not json at all\n")
+    main._journal_append_sync([(2, UserRecord(credits=7))])
+    size = log.stat().st_size
+
+    state: dict[int, UserRecord] = {}
+    main._replay_journal_sync(state, log)
+    assert state[1].credits == 4 and state[2].credits == 7
+    assert log.stat().st_size == size  # цілі записи після битої строки не обрізаємо